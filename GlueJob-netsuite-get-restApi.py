@@ -1,41 +1,125 @@
 import base64
+import bisect
 import hashlib
+import heapq
 import hmac
 import json
+import os
+import queue
 import random
+import re
+import sqlite3
+import subprocess
 import sys
+import tempfile
+import threading
 import time
 import urllib.parse
-from datetime import date, timedelta
+import uuid
+import zlib
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from itertools import chain
+from zoneinfo import ZoneInfo
 import boto3
 import requests
-from awsglue.utils import getResolvedOptions
-from requests_oauthlib import OAuth1
+from requests.adapters import HTTPAdapter
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
 import sentry_sdk
 from sentry_sdk.integrations.aws_lambda import AwsLambdaIntegration
 
-args = getResolvedOptions(sys.argv, ['kinesisfirehose', 'secretmanager', 'region', 'service', 'fullload'])
+try:
+    # orjson parses NetSuite payloads several times faster than json and accepts bytes without decoding
+    from orjson import loads as parse_json
+except ImportError:
+    from json import loads as parse_json
+
+try:
+    from awsglue.utils import getResolvedOptions
+except ImportError:
+    # outside Glue (local runs and benchmarks) arguments follow the same --name value convention
+    def getResolvedOptions(argv, options):
+        resolved = {}
+        for name in options:
+            if '--' + name not in argv or argv.index('--' + name) + 1 >= len(argv):
+                raise SystemExit("argument --" + name + " is required")
+            resolved[name] = argv[argv.index('--' + name) + 1]
+        return resolved
 
-kinesisfirehose_name = str(args['kinesisfirehose'])
-secretmanager_name = str(args['secretmanager'])
-region_name = str(args['region'])
-service = str(args['service'])
-fullload = args['fullload']
 prevday = date.today() + timedelta(days=-1)
 yesterday = str(prevday.strftime("%d/%m/%Y"))
 today = str(date.today().strftime("%d/%m/%Y"))
-url_not_200 =  []
-sentry_dsn = "https://b49b07d9a53040ceb0eb5329ba74d8e6@o4504973294305280.ingest.sentry.io/4505509437636608"
-
-if sentry_dsn:
-    sentry_sdk.init(
-        dsn=sentry_dsn,
-        integrations=[
-            AwsLambdaIntegration(),
-        ],
-        traces_sample_rate=1.0,
-    )
+# listing URLs that failed after retrying; failed record ids are kept per service
+url_not_200 = []
+# must match the date and time format preferences of the NetSuite integration user
+netsuite_datetime_format = "%d/%m/%Y %I:%M %p"
+
+
+def get_optional_args(argv, defaults):
+    """Resolve optional Glue job arguments, falling back to the given defaults"""
+    present = [name for name in defaults if '--' + name in argv]
+    resolved = getResolvedOptions(argv, present) if present else {}
+    return {name: resolved.get(name, default) for name, default in defaults.items()}
+
+
+optional_arg_defaults = {
+    'poolsize': 10,
+    'connecttimeout': 5,
+    'readtimeout': 60,
+    'packsize': 900,
+    'concurrency': 5,
+    'maxconcurrency': 10,
+    'leasetable': '',
+    'accountconcurrency': 15,
+    'leasettl': 120,
+    'maxattempts': 6,
+    'retrybase': 1,
+    'retrycap': 60,
+    'checkpoint': '',
+    'checkpointinterval': 300,
+    'resume': '0',
+    'watermark': '',
+    'watermarkoverlap': 60,
+    'timezone': 'Europe/London',
+    'hashindex': '',
+    'listingconcurrency': 1,
+    'queuesize': 1000,
+    'flushinterval': 30,
+    'mode': 'rest',
+    'expandsubresources': 'auto',
+    'maxexpandedsize': 900,
+    'services': '',
+    'serviceconfig': '',
+    # emf for CloudWatch Embedded Metric Format lines, stdout for readable local output, off to disable
+    'metrics': 'emf',
+    'metricsinterval': 60,
+    # --shard i/N extracts one share of the id space; --shards N runs all N shards as child processes
+    'shard': '',
+    'shards': 1,
+    'runid': '',
+    'runsummary': '',
+    # firehose, or parquet to write backfills straight into the Glue tables' S3 layout
+    'sink': 'firehose',
+    'gluedatabase': 'netsuite',
+    'parquetsize': 128,
+    # off, trim (drop keys that are not Glue catalog columns) or fields (trim and ask NetSuite for the columns only)
+    'projection': 'off',
+    # s3:// prefix or local directory of the response caches of response_cache_services
+    'responsecache': '',
+    # JSON overriding response_cache_services, e.g. {"employee": {"ttl_hours": 12, "probe": false}}
+    'cacheconfig': '',
+    # s3:// prefix or local directory of the deletes stage's state; the stage is off when empty
+    'deletes': '',
+}
+# SENTRY_DSN="" turns reporting off for local runs and benchmarks
+sentry_dsn = os.environ.get(
+    "SENTRY_DSN", "https://b49b07d9a53040ceb0eb5329ba74d8e6@o4504973294305280.ingest.sentry.io/4505509437636608")
+
+
 def getSecrets(secretmanager, region):
     # Create a Secrets Manager client
     session = boto3.session.Session()
@@ -58,22 +142,729 @@ def getSecrets(secretmanager, region):
     return secret
 
 
-secrets = getSecrets(secretmanager_name, region_name)
-account_id = secrets["accountid"]
-consumer_key = secrets["consumer_key"]
-consumer_secret = secrets["consumer_secret"]
-token = secrets["token"]
-token_secret = secrets["token_secret"]
-url = secrets["url"] + service
-headers = {"Content-Type": "application/json"}
-auth = OAuth1(
-    realm=account_id,
-    client_key=consumer_key,
-    client_secret=consumer_secret,
-    resource_owner_key=token,
-    resource_owner_secret=token_secret,
-    signature_method="HMAC-SHA256"
-)
+class OAuth1Signer(requests.auth.AuthBase):
+    """HMAC-SHA256 OAuth 1.0a signer that precomputes everything constant for one set of credentials"""
+
+    def __init__(self, realm, consumer_key, consumer_secret, token, token_secret):
+        quote = self.quote
+        # a keyed HMAC is copied per request instead of re-deriving the key each time
+        self.hmac = hmac.new((quote(consumer_secret) + "&" + quote(token_secret)).encode(), digestmod=hashlib.sha256)
+        self.oauth_params = [
+            ("oauth_consumer_key", quote(consumer_key)),
+            ("oauth_signature_method", "HMAC-SHA256"),
+            ("oauth_token", quote(token)),
+            ("oauth_version", "1.0"),
+        ]
+        self.header_prefix = ('OAuth realm="' + realm + '",oauth_consumer_key="' + quote(consumer_key) +
+                              '",oauth_token="' + quote(token) + '",oauth_signature_method="HMAC-SHA256",'
+                              'oauth_version="1.0",')
+        # quoted scheme://netloc per origin; paths end in a record id, so they are quoted on every call
+        self.origins = {}
+
+    @staticmethod
+    def quote(value):
+        return urllib.parse.quote(value, safe="~")
+
+    def base_url(self, scheme, netloc, path):
+        origin = self.origins.get((scheme, netloc))
+        if origin is None:
+            host = netloc.lower()
+            if (scheme == "https" and host.endswith(":443")) or (scheme == "http" and host.endswith(":80")):
+                host = host.rsplit(":", 1)[0]
+            origin = self.quote(scheme.lower() + "://" + host)
+            self.origins[(scheme, netloc)] = origin
+        # percent-encoding is per character, so the quoted origin and path concatenate to the quoted URL
+        return origin + self.quote(path)
+
+    def authorization(self, method, url, nonce=None, timestamp=None):
+        """Return the Authorization header for a request, signing every query parameter in the URL"""
+        scheme, netloc, path, query, _ = urllib.parse.urlsplit(url)
+        nonce = nonce or uuid.uuid4().hex
+        timestamp = timestamp or str(int(time.time()))
+        quote = self.quote
+        params = [(quote(k), quote(v)) for k, v in urllib.parse.parse_qsl(query, keep_blank_values=True)]
+        params += self.oauth_params
+        params += [("oauth_nonce", nonce), ("oauth_timestamp", timestamp)]
+        params.sort()
+        normalized = "&".join(k + "=" + v for k, v in params)
+        base = method.upper() + "&" + self.base_url(scheme, netloc, path) + "&" + quote(normalized)
+        digest = self.hmac.copy()
+        digest.update(base.encode())
+        signature = quote(base64.b64encode(digest.digest()).decode())
+        return (self.header_prefix + 'oauth_timestamp="' + timestamp + '",oauth_nonce="' + nonce +
+                '",oauth_signature="' + signature + '"')
+
+    def __call__(self, request):
+        request.headers["Authorization"] = self.authorization(request.method, request.url)
+        return request
+
+
+class Metrics:
+    """Run counters and latency histograms, exported periodically as CloudWatch EMF JSON lines or plain text"""
+    namespace = "NetSuiteExtractor"
+    # histogram bucket upper bounds in milliseconds
+    buckets = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+    def __init__(self, exporter='emf', interval=60):
+        self.exporter = exporter
+        self.interval = float(interval)
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.period_start = time.monotonic()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def count(self, name, value=1, unit='Count', **dimensions):
+        key = (name, unit, tuple(sorted(dimensions.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name, value, unit='Count', **dimensions):
+        """Record the current value of a level such as the concurrency limit; each emit reports the latest one"""
+        key = (name, unit, tuple(sorted(dimensions.items())))
+        with self.lock:
+            self.gauges[key] = value
+
+    def observe(self, name, milliseconds, **dimensions):
+        key = (name, 'Milliseconds', tuple(sorted(dimensions.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {
+                    'counts': [0] * (len(self.buckets) + 1), 'min': milliseconds, 'max': milliseconds, 'sum': 0.0
+                }
+            histogram['counts'][bisect.bisect_left(self.buckets, milliseconds)] += 1
+            histogram['min'] = min(histogram['min'], milliseconds)
+            histogram['max'] = max(histogram['max'], milliseconds)
+            histogram['sum'] += milliseconds
+
+    def start(self):
+        if self.exporter != 'off':
+            self.thread = threading.Thread(target=self.run, name="metrics", daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.emit()
+
+    def close(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.emit()
+
+    def percentile(self, histogram, fraction):
+        """Upper bound of the bucket holding the given fraction of observations"""
+        target = fraction * sum(histogram['counts'])
+        seen = 0
+        for bound, count in zip(self.buckets, histogram['counts']):
+            seen += count
+            if seen >= target:
+                return min(bound, histogram['max'])
+        return histogram['max']
+
+    def emit(self):
+        """Write and reset the metrics gathered since the last emit, one line per dimension set"""
+        with self.lock:
+            counters, self.counters = self.counters, {}
+            gauges, self.gauges = self.gauges, {}
+            histograms, self.histograms = self.histograms, {}
+            elapsed = max(time.monotonic() - self.period_start, 0.001)
+            self.period_start = time.monotonic()
+        if self.exporter == 'off':
+            return
+        groups = {}
+        for (name, unit, dimensions), value in counters.items():
+            groups.setdefault(dimensions, []).append((name, unit, value))
+            if name == 'Records':
+                groups[dimensions].append(('RecordsPerSecond', 'Count/Second', round(value / elapsed, 2)))
+        for (name, unit, dimensions), value in gauges.items():
+            groups.setdefault(dimensions, []).append((name, unit, value))
+        for (name, unit, dimensions), histogram in histograms.items():
+            groups.setdefault(dimensions, []).append((name, unit, histogram))
+        for dimensions, values in groups.items():
+            if self.exporter == 'emf':
+                print(json.dumps(self.emf_document(dimensions, values)))
+            else:
+                print("metrics", " ".join(k + "=" + str(v) for k, v in dimensions),
+                      " ".join(self.describe(name, value) for name, _, value in values))
+
+    def emf_document(self, dimensions, values):
+        document = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": self.namespace,
+                    "Dimensions": [[k for k, _ in dimensions]],
+                    "Metrics": [{"Name": name, "Unit": unit} for name, unit, _ in values]
+                }]
+            }
+        }
+        document.update(dimensions)
+        for name, _, value in values:
+            if isinstance(value, dict):
+                # EMF histogram: each non-empty bucket reported at its upper bound with its count
+                buckets = [(round(min(bound, value['max']), 3), count)
+                           for bound, count in zip(self.buckets + (value['max'],), value['counts']) if count]
+                value = {"Values": [v for v, _ in buckets], "Counts": [c for _, c in buckets],
+                         "Min": round(value['min'], 3), "Max": round(value['max'], 3),
+                         "Sum": round(value['sum'], 3), "Count": sum(value['counts'])}
+            document[name] = value
+        return document
+
+    def describe(self, name, value):
+        if isinstance(value, dict):
+            return (name + ": count=" + str(sum(value['counts'])) +
+                    " p50=" + str(round(self.percentile(value, 0.5), 1)) +
+                    " p99=" + str(round(self.percentile(value, 0.99), 1)) +
+                    " max=" + str(round(value['max'], 1)) + "ms")
+        return name + "=" + str(value)
+
+
+def metric_service(url):
+    """Service dimension for a NetSuite URL: the record type for REST calls, the endpoint name otherwise"""
+    path = urllib.parse.urlsplit(url).path
+    if '/record/v1/' in path:
+        return path.split('/record/v1/', 1)[1].split('/', 1)[0]
+    return path.rstrip('/').rsplit('/', 1)[-1]
+
+
+def parse_retry_after(value):
+    """Return the Retry-After header as seconds, accepting both delta-seconds and HTTP-date forms"""
+    if not value:
+        return 0
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return 0
+
+
+def is_throttled(response):
+    if response.status_code == 429:
+        return True
+    # NetSuite reports concurrency governance on some endpoints as a 4xx with an error code in the body
+    return response.status_code != 200 and b'CONCURRENCY_LIMIT_EXCEEDED' in response.content
+
+
+class ConcurrencyGovernor:
+    """AIMD limit on in-flight NetSuite requests: grows by one per healthy round, halves on throttling"""
+
+    def __init__(self, initial=5, minimum=1, maximum=10):
+        self.minimum = float(minimum)
+        self.maximum = float(maximum)
+        self.limit = min(self.maximum, max(self.minimum, float(initial)))
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.throttled = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                wait = self.blocked_until - time.monotonic()
+                if wait > 0:
+                    self.condition.wait(wait)
+                elif self.in_flight < int(self.limit):
+                    break
+                else:
+                    self.condition.wait()
+            self.in_flight += 1
+            return time.monotonic()
+
+    def release(self, started, response=None):
+        with self.condition:
+            self.in_flight -= 1
+            if response is not None and is_throttled(response):
+                self.throttled += 1
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                if retry_after:
+                    self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+                # requests already in flight when we backed off must not halve the limit again
+                if started >= self.last_decrease:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self.last_decrease = time.monotonic()
+                    print("NetSuite throttled the job, concurrency limit lowered to", int(self.limit))
+            elif response is not None and response.status_code < 500:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    @property
+    def current_limit(self):
+        return int(self.limit)
+
+
+class AccountConcurrencyLeases:
+    """Account-wide NetSuite concurrency slots shared by every extractor run through a DynamoDB table"""
+
+    def __init__(self, table_name, slots=15, ttl=120, dynamodb=None):
+        self.table_name = table_name
+        self.slots = int(slots)
+        # a crashed holder's slot is reclaimed once its lease expires, so ttl must outlast the read timeout
+        self.ttl = int(ttl)
+        self.dynamodb = dynamodb or boto3.client('dynamodb', region_name=region_name)
+        self.holder = service + "-" + uuid.uuid4().hex
+        self.waits = 0
+
+    def acquire(self):
+        """Claim a free or expired slot, returning the (slot, token) lease to release"""
+        # every lease gets its own token: a thread of this run that took over an expired slot must not have its
+        # lease deleted by the thread that let it expire
+        token = uuid.uuid4().hex
+        attempt = 0
+        while True:
+            now = int(time.time())
+            start = random.randrange(self.slots)
+            for i in range(self.slots):
+                slot = (start + i) % self.slots
+                try:
+                    self.dynamodb.put_item(
+                        TableName=self.table_name,
+                        Item={
+                            'lease_slot': {'N': str(slot)},
+                            'holder': {'S': self.holder},
+                            'token': {'S': token},
+                            'expires_at': {'N': str(now + self.ttl)}
+                        },
+                        ConditionExpression='attribute_not_exists(lease_slot) OR expires_at < :now',
+                        ExpressionAttributeValues={':now': {'N': str(now)}}
+                    )
+                    return slot, token
+                except ClientError as e:
+                    if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                        raise
+            attempt += 1
+            self.waits += 1
+            time.sleep(random.uniform(0, min(2, 0.05 * 2 ** attempt)))
+
+    def release(self, lease):
+        slot, token = lease
+        try:
+            self.dynamodb.delete_item(
+                TableName=self.table_name,
+                Key={'lease_slot': {'N': str(slot)}},
+                ConditionExpression='#token = :token',
+                ExpressionAttributeNames={'#token': 'token'},
+                ExpressionAttributeValues={':token': {'S': token}}
+            )
+        except ClientError as e:
+            # the lease expired and another request already took the slot over
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+
+class NetSuiteClient:
+    """Keep-alive HTTP client sharing one pooled session for all NetSuite calls"""
+
+    def __init__(self, auth, pool_size=10, connect_timeout=5, read_timeout=60, governor=None, leases=None,
+                 metrics=None):
+        self.session = requests.Session()
+        self.session.auth = auth
+        self.session.headers.update({"Content-Type": "application/json", "Connection": "keep-alive"})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=int(pool_size), max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.timeout = (float(connect_timeout), float(read_timeout))
+        self.governor = governor or ConcurrencyGovernor()
+        self.leases = leases
+        self.metrics = metrics or Metrics(exporter='off')
+
+    def request(self, method, url, **kwargs):
+        waited = time.monotonic()
+        started = self.governor.acquire()
+        response = None
+        lease = None
+        sent = None
+        status = 'error'
+        service_name = metric_service(url)
+        try:
+            if self.leases is not None:
+                lease = self.leases.acquire()
+            sent = time.monotonic()
+            self.metrics.observe('SlotWait', (sent - waited) * 1000, Service=service_name)
+            response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            status = str(response.status_code)
+            self.metrics.count('BytesFetched', len(response.content), unit='Bytes', Service=service_name)
+            if is_throttled(response):
+                self.metrics.count('Throttled', Service=service_name)
+            return response
+        finally:
+            if lease is not None:
+                self.leases.release(lease)
+            self.governor.release(started, response)
+            self.metrics.gauge('ConcurrencyLimit', self.governor.current_limit, Service=service_name)
+            if sent is not None:
+                self.metrics.observe('RequestLatency', (time.monotonic() - sent) * 1000,
+                                     Service=service_name, StatusCode=status)
+
+    def get(self, url, params=None):
+        return self.request("GET", url, params=params or None)
+
+    def post(self, url, params=None, json=None, headers=None):
+        return self.request("POST", url, params=params or None, json=json, headers=headers)
+
+    def close(self):
+        self.session.close()
+
+
+class FirehoseSink:
+    """Buffers records and ships them to Firehose with PutRecordBatch, re-driving failed entries"""
+    max_batch_records = 500
+    max_batch_bytes = 4 * 1024 * 1024
+    max_record_bytes = 1000 * 1024
+    max_attempts = 8
+
+    def __init__(self, stream_name, firehose=None, metrics=None):
+        self.stream_name = stream_name
+        self.firehose = firehose or boto3.client('firehose', region_name=region_name)
+        self.metrics = metrics or Metrics(exporter='off')
+        self.buffer = []
+        self.buffer_bytes = 0
+        self.records_sent = 0
+        self.records_failed = 0
+        self.batches_sent = 0
+
+    def put(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if len(data) > self.max_record_bytes:
+            print("Record of", len(data), "bytes exceeds the Firehose record limit, dropping it")
+            self.records_failed += 1
+            return
+        if len(self.buffer) == self.max_batch_records or self.buffer_bytes + len(data) > self.max_batch_bytes:
+            self.flush()
+        self.buffer.append(data)
+        self.buffer_bytes += len(data)
+
+    def flush(self):
+        records = self.buffer
+        self.buffer = []
+        self.buffer_bytes = 0
+        attempt = 0
+        while records:
+            started = time.monotonic()
+            try:
+                response = self.firehose.put_record_batch(
+                    DeliveryStreamName=self.stream_name,
+                    Records=[{'Data': data} for data in records]
+                )
+            except ClientError as e:
+                self.metrics.count('FirehoseBatchErrors', Stream=self.stream_name)
+                attempt += 1
+                if e.response['Error']['Code'] != 'ServiceUnavailableException' or attempt >= self.max_attempts:
+                    raise
+                self.backoff(attempt)
+                continue
+            self.batches_sent += 1
+            self.metrics.observe('FirehoseBatchLatency', (time.monotonic() - started) * 1000, Stream=self.stream_name)
+            self.metrics.count('FirehoseRecordsFailed', response['FailedPutCount'], Stream=self.stream_name)
+            failed = []
+            if response['FailedPutCount'] > 0:
+                failed = [data for data, result in zip(records, response['RequestResponses']) if 'ErrorCode' in result]
+            self.records_sent += len(records) - len(failed)
+            records = failed
+            if records:
+                attempt += 1
+                if attempt >= self.max_attempts:
+                    self.records_failed += len(records)
+                    print(len(records), "records failed to reach", self.stream_name, "after", attempt, "attempts")
+                    break
+                print(len(records), "records failed in batch, retrying attempt:", attempt)
+                self.backoff(attempt)
+
+    @staticmethod
+    def backoff(attempt, base=0.2, cap=20):
+        time.sleep(random.uniform(0, min(cap, base * 2 ** attempt)))
+
+    def close(self):
+        self.flush()
+        print("Firehose records sent:", self.records_sent, "batches:", self.batches_sent,
+              "failed:", self.records_failed)
+        if self.records_failed > 0:
+            sentry_sdk.capture_message(
+                str(self.records_failed) + " records failed to reach delivery stream " + self.stream_name)
+
+
+class RecordPacker:
+    """Packs newline-delimited JSON records into fewer, larger Firehose records"""
+    billing_increment = 5 * 1024
+    # the pipeline flushes every --flushinterval and before checkpoint saves, so records reach Firehose without
+    # waiting for a full pack
+    flush_on_interval = True
+
+    def __init__(self, sink, max_bytes=900 * 1024):
+        self.sink = sink
+        self.max_bytes = min(int(max_bytes), FirehoseSink.max_record_bytes)
+        self.pending = []
+        self.pending_bytes = 0
+        self.records_in = 0
+        self.records_out = 0
+        self.billed_bytes_unpacked = 0
+        self.billed_bytes_packed = 0
+
+    def billed(self, size):
+        return -(-size // self.billing_increment) * self.billing_increment
+
+    def put(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if b'\n' in data:
+            # OpenX JSON SerDe splits packed records on newlines, so each document must sit on one line
+            data = json.dumps(parse_json(data), separators=(',', ':')).encode('utf-8')
+        # the body and its newline are joined once per packed record instead of copying every body here
+        size = len(data) + 1
+        self.records_in += 1
+        self.billed_bytes_unpacked += self.billed(size)
+        if self.pending and self.pending_bytes + size > self.max_bytes:
+            self.emit()
+        self.pending.append(data)
+        self.pending.append(b'\n')
+        self.pending_bytes += size
+
+    def emit(self):
+        packed = b''.join(self.pending)
+        self.pending = []
+        self.pending_bytes = 0
+        self.records_out += 1
+        self.billed_bytes_packed += self.billed(len(packed))
+        self.sink.put(packed)
+
+    def flush(self):
+        if self.pending:
+            self.emit()
+        self.sink.flush()
+
+    def close(self):
+        if self.pending:
+            self.emit()
+        if self.records_out > 0:
+            print("Packed", self.records_in, "records into", self.records_out, "Firehose records,",
+                  "packing ratio:", round(self.records_in / self.records_out, 2),
+                  "billed KB:", self.billed_bytes_packed // 1024, "instead of", self.billed_bytes_unpacked // 1024)
+
+
+# only the Parquet backfill sink (--sink parquet) needs pyarrow; it is imported for that sink alone because loading
+# it would cost every other run tens of MB of the pythonshell worker's memory
+pyarrow = None
+
+
+def import_pyarrow():
+    """Import pyarrow for the Parquet sink, returning False when it is not installed"""
+    global pyarrow
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        return False
+    return True
+
+
+def split_type_list(text):
+    """Split 'a:int,b:struct<c:int,d:int>' on the commas that are not nested inside <>"""
+    parts, depth, start = [], 0, 0
+    for i, char in enumerate(text):
+        if char == '<':
+            depth += 1
+        elif char == '>':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return parts
+
+
+def arrow_type(column_type):
+    """Arrow type of a Glue catalog column type such as struct<id:string,refName:string>"""
+    column_type = column_type.strip()
+    lowered = column_type.lower()
+    if lowered.startswith('array<'):
+        return pyarrow.list_(arrow_type(column_type[6:-1]))
+    if lowered.startswith('struct<'):
+        fields = [part.partition(':') for part in split_type_list(column_type[7:-1])]
+        return pyarrow.struct([pyarrow.field(name.strip(), arrow_type(field_type)) for name, _, field_type in fields])
+    primitives = {
+        'string': pyarrow.string(), 'varchar': pyarrow.string(), 'char': pyarrow.string(),
+        'boolean': pyarrow.bool_(), 'double': pyarrow.float64(), 'float': pyarrow.float32(),
+        'tinyint': pyarrow.int8(), 'smallint': pyarrow.int16(), 'int': pyarrow.int32(), 'bigint': pyarrow.int64(),
+    }
+    if lowered.split('(')[0] not in primitives:
+        raise ValueError("Unsupported Glue column type: " + column_type)
+    return primitives[lowered.split('(')[0]]
+
+
+def column_converter(data_type):
+    """Function fitting a JSON value to an Arrow type the way Firehose's OpenX JSON SerDe does, None when it cannot"""
+    if pyarrow.types.is_struct(data_type):
+        fields = [(field.name, field.name.lower(), column_converter(field.type)) for field in data_type]
+
+        def convert(value):
+            if not isinstance(value, dict):
+                return None
+            # OpenX matches JSON keys to column names case-insensitively
+            lowered = {key.lower(): item for key, item in value.items()}
+            return {name: to_field(lowered.get(key)) for name, key, to_field in fields}
+        return convert
+    if pyarrow.types.is_list(data_type):
+        to_item = column_converter(data_type.value_type)
+
+        def convert(value):
+            return [to_item(item) for item in value] if isinstance(value, list) else None
+        return convert
+    if pyarrow.types.is_string(data_type):
+        def convert(value):
+            if value is None or isinstance(value, str):
+                return value
+            if isinstance(value, bool):
+                return 'true' if value else 'false'
+            if isinstance(value, (dict, list)):
+                return json.dumps(value, separators=(',', ':'))
+            return str(value)
+        return convert
+    if pyarrow.types.is_boolean(data_type):
+        def convert(value):
+            if isinstance(value, bool):
+                return value
+            return {'true': True, 'false': False}.get(value.lower()) if isinstance(value, str) else None
+        return convert
+    number = float if pyarrow.types.is_floating(data_type) else int
+    limit = 2 ** (data_type.bit_width - 1) if pyarrow.types.is_integer(data_type) else None
+
+    def convert(value):
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            return None
+        try:
+            value = number(value)
+        except ValueError:
+            return None
+        return None if limit is not None and not -limit <= value < limit else value
+    return convert
+
+
+class ParquetSink:
+    """Writes a service's records as Snappy Parquet files straight into its Glue table's S3 location and partition
+    layout, so backfills skip Firehose and its JSON to Parquet conversion"""
+    # a flush uploads the open file, so neither --flushinterval nor checkpoint saves flush it and files are only
+    # cut at target_bytes; checkpoints are saved when a file has just been uploaded, so with --checkpoint a resumed
+    # backfill repeats at most one file's worth of records
+    flush_on_interval = False
+    batch_rows = 1000
+    row_group_bytes = 32 * 1024 * 1024
+    partition_formats = {'year': '%Y', 'month': '%m', 'day': '%d', 'hour': '%H'}
+    transfer_config = TransferConfig(multipart_threshold=16 * 1024 * 1024, multipart_chunksize=16 * 1024 * 1024)
+
+    def __init__(self, table, target_bytes=128 * 1024 * 1024, s3=None, metrics=None):
+        storage = table['StorageDescriptor']
+        self.service = table['Name']
+        self.schema = pyarrow.schema([pyarrow.field(column['Name'], arrow_type(column['Type']))
+                                      for column in storage['Columns']])
+        self.to_row = column_converter(pyarrow.struct(list(self.schema)))
+        self.partition_keys = [key['Name'] for key in table.get('PartitionKeys', [])]
+        unknown = [key for key in self.partition_keys if key not in self.partition_formats]
+        if unknown:
+            raise SystemExit("Cannot write partition keys " + ", ".join(unknown) + " of Glue table " + self.service)
+        self.bucket, self.prefix = split_s3_location(storage['Location'], '')
+        self.target_bytes = int(target_bytes)
+        self.s3 = s3 or boto3.client('s3', region_name=region_name)
+        self.metrics = metrics or Metrics(exporter='off')
+        self.rows = []
+        self.batches = []
+        self.batch_bytes = 0
+        self.writer = None
+        self.path = None
+        self.opened = None
+        self.file_rows = 0
+        self.records_sent = 0
+        self.records_failed = 0
+        self.files_written = 0
+        self.bytes_written = 0
+        self.closed = False
+
+    @property
+    def sink(self):
+        # stands in for both the packer and its sink
+        return self
+
+    def put(self, data):
+        self.rows.append(self.to_row(parse_json(data)))
+        if len(self.rows) >= self.batch_rows:
+            self.add_batch()
+
+    def add_batch(self):
+        if not self.rows:
+            return
+        batch = pyarrow.RecordBatch.from_pylist(self.rows, schema=self.schema)
+        self.rows = []
+        self.batches.append(batch)
+        self.batch_bytes += batch.nbytes
+        if self.batch_bytes >= self.row_group_bytes:
+            self.write_row_group()
+
+    def write_row_group(self):
+        self.add_batch()
+        if not self.batches:
+            return
+        if self.writer is None:
+            handle, self.path = tempfile.mkstemp(prefix=self.service + "-", suffix=".parquet")
+            os.close(handle)
+            # Firehose partitions by arrival time in UTC, so a file's partition is the time it was started
+            self.opened = datetime.now(timezone.utc)
+            self.writer = pyarrow.parquet.ParquetWriter(self.path, self.schema, compression='snappy')
+        table = pyarrow.Table.from_batches(self.batches, schema=self.schema)
+        self.writer.write_table(table, row_group_size=table.num_rows)
+        self.file_rows += table.num_rows
+        self.batches = []
+        self.batch_bytes = 0
+        if os.path.getsize(self.path) >= self.target_bytes:
+            self.upload()
+
+    def object_key(self):
+        partition = "".join(key + "=" + self.opened.strftime(self.partition_formats[key]) + "/"
+                            for key in self.partition_keys)
+        name = self.service + "-backfill-" + self.opened.strftime("%Y-%m-%d-%H-%M-%S") + "-" + uuid.uuid4().hex
+        return self.prefix + partition + name + ".parquet"
+
+    def upload(self):
+        if self.writer is None:
+            return
+        self.writer.close()
+        self.writer = None
+        size = os.path.getsize(self.path)
+        key = self.object_key()
+        started = time.monotonic()
+        # upload_file switches to a multipart upload above the threshold, sending the parts in parallel
+        self.s3.upload_file(self.path, self.bucket, key, Config=self.transfer_config)
+        os.remove(self.path)
+        self.metrics.observe('ParquetUploadLatency', (time.monotonic() - started) * 1000, Service=self.service)
+        self.metrics.count('ParquetFiles', Service=self.service)
+        self.metrics.count('ParquetBytes', size, unit='Bytes', Service=self.service)
+        self.records_sent += self.file_rows
+        self.files_written += 1
+        self.bytes_written += size
+        self.file_rows = 0
+        print("Wrote s3://" + self.bucket + "/" + key, size, "bytes")
+
+    def flush(self):
+        self.write_row_group()
+        self.upload()
+
+    def buffered(self):
+        """Whether any record put so far is not in an uploaded file yet"""
+        return bool(self.rows or self.batches or self.writer is not None)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.flush()
+        print("Parquet records written for", self.service, ":", self.records_sent, "files:", self.files_written,
+              "MB:", round(self.bytes_written / (1024 * 1024), 1))
+
 
 def generateNonce(length=11):
     """Generate pseudorandom number"""
@@ -106,52 +897,318 @@ def generateSignature(method, url, consumer_key, nonce, current_time, token, con
     return urllib.parse.quote_plus(signature)
 
 
-def get_response(url, params):
-    headers = {"Content-Type": "application/json"}
+def request_record(url, params):
+    """GET one NetSuite resource, returning (status, body bytes, retry_after) with status None on connection failure"""
+    try:
+        response = client.get(url, params=params)
+    except Exception:
+        return None, json.dumps({"msg": "url failed due connection issue", "url": url}).encode('utf-8'), 0
+    # the raw body is forwarded to Firehose as-is, so it is never decoded to text
+    if response.status_code == 200:
+        return 200, response.content, 0
+    return response.status_code, response.content, parse_retry_after(response.headers.get('Retry-After'))
+
+
+def is_retryable(status, body):
+    # 429, 5xx and dropped connections are transient; any other 4xx will fail the same way again
+    if status is None or status == 429 or status >= 500:
+        return True
+    return b'CONCURRENCY_LIMIT_EXCEEDED' in body
+
+
+def retry_delay(attempt, retry_after=0, base=1.0, cap=60.0):
+    """Exponential backoff with full jitter, never shorter than the server's Retry-After"""
+    return max(retry_after, random.uniform(0, min(cap, base * 2 ** attempt)))
+
+
+def error_output(url, body):
     try:
-        response = requests.request("GET", url, auth=auth, headers=headers, params=params)
-        response_output = response.text
-        if response.status_code!=200:
+        dic_response = parse_json(body)
+    except ValueError:
+        dic_response = {"msg": body.decode('utf-8', 'replace')}
+    if not isinstance(dic_response, dict):
+        dic_response = {"msg": dic_response}
+    dic_response.update({"url": url})
+    return json.dumps(dic_response).encode('utf-8')
+
+
+def get_response(url, params):
+    attempt = 0
+    while True:
+        status, body, retry_after = request_record(url, params)
+        if status == 200:
+            return body
+        attempt += 1
+        if not is_retryable(status, body) or attempt >= retries.max_attempts:
             url_not_200.append(url)
-            dic_response = json.loads(response.text)
-            dic_response.update({"url": url})
-            response_output = json.dumps(dic_response)
-    except:
-        url_not_200.append(url)
-        dic_response = {"msg": "url failed due connection issue"}
-        dic_response.update({"url": url})
-        response_output = json.dumps(dic_response)
-    return response_output
+            metrics.count('RequestsFailed', Service=metric_service(url))
+            return error_output(url, body)
+        metrics.count('Retries', Service=metric_service(url))
+        time.sleep(retries.delay(attempt, retry_after))
+
+
+class RetrySchedule:
+    """Per-request retry timetable: failed URLs wait out their backoff while workers keep taking fresh work"""
+
+    def __init__(self, max_attempts=6, base=1, cap=60):
+        self.max_attempts = int(max_attempts)
+        self.base = float(base)
+        self.cap = float(cap)
+        self.heap = []
+        self.counter = 0
+        self.retried = 0
+        self.lock = threading.Lock()
+
+    def delay(self, attempt, retry_after=0):
+        return retry_delay(attempt, retry_after, self.base, self.cap)
+
+    def schedule(self, task, attempt, retry_after=0):
+        """Queue the task for another attempt, or return False once its attempt budget is spent"""
+        if attempt >= self.max_attempts:
+            return False
+        with self.lock:
+            self.counter += 1
+            heapq.heappush(self.heap, (time.monotonic() + self.delay(attempt, retry_after), self.counter,
+                                       task, attempt))
+            self.retried += 1
+        return True
+
+    def pop_due(self):
+        with self.lock:
+            if self.heap and self.heap[0][0] <= time.monotonic():
+                _, _, task, attempt = heapq.heappop(self.heap)
+                return task, attempt
+        return None
+
+
+# transaction records whose item/line sublists only arrive as links unless expanded
+expand_sub_resources_services = {'invoice', 'purchaseorder', 'vendorbill', 'journalentry'}
+
+
+# reference data that changes a few times a month: records fetched within ttl_hours are served from the response
+# cache, and the probe asks NetSuite which records changed since the last run to refetch those regardless
+response_cache_services = {
+    'subsidiary': {'ttl_hours': 168, 'probe': True},
+    'employee': {'ttl_hours': 24, 'probe': True},
+    'vendorsubsidiaryrelationship': {'ttl_hours': 168, 'probe': True},
+}
+
+
+def expand_sub_resources_for(service):
+    if optional_args['expandsubresources'] == 'auto':
+        return service in expand_sub_resources_services
+    return optional_args['expandsubresources'] == '1'
+
+
+def get_record(url_with_id, expand=False, fields=None):
+    """Fetch one record, inlining its sub-resources when enabled and small enough to ship"""
+    params = {'fields': fields} if fields else {}
+    if expand:
+        status, body, retry_after = request_record(url_with_id, params=dict(params, expandSubResources='true'))
+        size = len(body)
+        if status != 200 or size <= max_expanded_bytes:
+            return status, body, retry_after
+        print("Expanded record", url_with_id, "is", size, "bytes, fetching it without sub-resources")
+    return request_record(url_with_id, params=params)
 
 
 def put_kinesis_firehose(data):
-    firehose = boto3.client('firehose')
-    stream_name = kinesisfirehose_name
-    # stream_name = 'json_stream'
-    # Put the data to the delivery stream
-    response = firehose.put_record(
-        DeliveryStreamName=stream_name,
-        Record={
-            'Data': data
-        }
-    )
+    packer.put(data)
 
-    if response['ResponseMetadata']['HTTPStatusCode'] == 200:
-        print('Data sent to the delivery stream successfully.')
+
+def split_s3_location(location, name):
+    bucket, _, prefix = location[len("s3://"):].partition("/")
+    return bucket, prefix.rstrip("/") + "/" + name if prefix else name
+
+
+def read_state(location, name):
+    """Read a job state file from an s3:// prefix or a local directory, returning None when it does not exist"""
+    try:
+        if location.startswith("s3://"):
+            bucket, key = split_s3_location(location, name)
+            return boto3.client('s3', region_name=region_name).get_object(Bucket=bucket, Key=key)['Body'].read()
+        with open(os.path.join(location, name), 'rb') as f:
+            return f.read()
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None
+        raise
+    except FileNotFoundError:
+        return None
+
+
+def write_state(location, name, body):
+    if location.startswith("s3://"):
+        bucket, key = split_s3_location(location, name)
+        boto3.client('s3', region_name=region_name).put_object(Bucket=bucket, Key=key, Body=body)
     else:
-        print('Failed to send data to the delivery stream.')
+        path = os.path.join(location, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb' if isinstance(body, bytes) else 'w') as f:
+            f.write(body)
+
+
+def create_state(location, name, body):
+    """Write a state file only if it does not exist yet, returning whether this call created it"""
+    if location.startswith("s3://"):
+        bucket, key = split_s3_location(location, name)
+        try:
+            boto3.client('s3', region_name=region_name).put_object(Bucket=bucket, Key=key, Body=body,
+                                                                    IfNoneMatch='*')
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                return False
+            raise
+        return True
+    path = os.path.join(location, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, 'wb' if isinstance(body, bytes) else 'w') as f:
+        f.write(body)
+    return True
+
+
+def delete_state(location, name):
+    if location.startswith("s3://"):
+        bucket, key = split_s3_location(location, name)
+        boto3.client('s3', region_name=region_name).delete_object(Bucket=bucket, Key=key)
+    elif os.path.exists(os.path.join(location, name)):
+        os.remove(os.path.join(location, name))
+
+
+class CompactIds:
+    """Set of NetSuite record ids kept as a sorted array of 8-byte integers, with a plain set for non-numeric ids"""
+
+    def __init__(self, ids=()):
+        self.sorted = array('q')
+        # integer ids not merged into the sorted array yet
+        self.recent = set()
+        self.other = set()
+        self.update(ids)
+
+    @staticmethod
+    def as_int(id):
+        # only ids that survive a round trip through int are stored as integers
+        if id.isascii() and id.isdigit() and len(id) < 19 and (id[0] != '0' or id == '0'):
+            return int(id)
+        return None
+
+    def add(self, id):
+        number = self.as_int(id)
+        if number is None:
+            self.other.add(id)
+        elif number not in self.recent and not self.in_sorted(number):
+            self.recent.add(number)
+            if len(self.recent) > max(4096, len(self.sorted) // 8):
+                self.merge()
+
+    def update(self, ids):
+        for id in ids:
+            self.add(id)
+
+    def in_sorted(self, number):
+        i = bisect.bisect_left(self.sorted, number)
+        return i < len(self.sorted) and self.sorted[i] == number
+
+    def merge(self):
+        if self.recent:
+            self.sorted = array('q', heapq.merge(self.sorted, sorted(self.recent)))
+            self.recent = set()
+
+    def __contains__(self, id):
+        number = self.as_int(id)
+        if number is None:
+            return id in self.other
+        return number in self.recent or self.in_sorted(number)
+
+    def __len__(self):
+        return len(self.sorted) + len(self.recent) + len(self.other)
+
+    def __iter__(self):
+        self.merge()
+        for number in self.sorted:
+            yield str(number)
+        yield from self.other
+
+
+def parse_shard(value):
+    """'i/N' -> (i, N), numbering shards from 0"""
+    index, _, count = value.partition('/')
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        index, count = -1, 0
+    if not 0 <= index < count:
+        raise SystemExit("--shard must be i/N with 0 <= i < N, got " + value)
+    return index, count
+
+
+def shard_of(id, count):
+    """Stable shard of a record id: numeric ids by value, anything else by CRC32"""
+    number = CompactIds.as_int(id)
+    if number is None:
+        number = zlib.crc32(id.encode('utf-8'))
+    return number % count
 
 
-def return_url_list():
-    url_list = []
-    offset = 0
+def listing_params(watermark=None):
     if fullload == "1":
-        params = ""
-    else:
-        params = {
-            'q': f'lastModifiedDate ON_OR_AFTER "' + yesterday + '" AND lastModifiedDate BEFORE "' + today + '"'
-        }
-    response = json.loads(get_response(url, params))
+        return {}
+    since = watermark.since() if watermark is not None else None
+    if since is not None:
+        return {'q': 'lastModifiedDate ON_OR_AFTER "' + since.strftime(netsuite_datetime_format) + '"'}
+    return {
+        'q': f'lastModifiedDate ON_OR_AFTER "' + yesterday + '" AND lastModifiedDate BEFORE "' + today + '"'
+    }
+
+
+def listing_window_start(params):
+    """Start of the lastModifiedDate window of listing_params, in the account's time zone; None for a full load"""
+    match = re.search(r'ON_OR_AFTER "([^"]+)"', (params or {}).get('q', ''))
+    if match is None:
+        return None
+    for date_format in (netsuite_datetime_format, "%d/%m/%Y"):
+        try:
+            return datetime.strptime(match.group(1), date_format).replace(tzinfo=netsuite_timezone)
+        except ValueError:
+            pass
+    return None
+
+
+def fetch_listing_page(listing_url, params, offset):
+    print("offset: ", offset)
+    param_offset = dict(params, offset=offset)
+    response = get_response(listing_url, params=param_offset)
+    dict_response = parse_json(response)
+    try:
+        return dict_response['items']
+    except:
+        print("Exceeds request limit, please try again after sometime")
+        sys.exit(1)
+
+
+def iter_listing_pages_concurrently(listing_url, params, offsets, workers):
+    """Fetch listing pages on a small thread pool, yielding (offset, items) in page order"""
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="listing") as executor:
+        pending = deque()
+        for offset in offsets:
+            pending.append((offset, executor.submit(fetch_listing_page, listing_url, params, offset)))
+            if len(pending) >= workers * 2:
+                offset, future = pending.popleft()
+                yield offset, future.result()
+        while pending:
+            offset, future = pending.popleft()
+            yield offset, future.result()
+
+
+def iter_listing_ids(listing_url, listing_concurrency=1, params=None, start_offset=0, checkpoint=None,
+                     watermark=None, shard=None):
+    if params is None:
+        params = listing_params(watermark)
+    response = parse_json(get_response(listing_url, params))
     # print("::::: Response: ",response)
     try:
         total_records = response['totalResults']
@@ -160,35 +1217,403 @@ def return_url_list():
         sys.exit(1)
 
     print("::::::Total Number of records to fetch: ", total_records)
-    while (offset < total_records):
-        print("offset: ", offset)
-        if fullload == "1":
-            param_offset = {
-                'offset': offset
-            }
+    if start_offset > 0:
+        print("Resuming listing from offset: ", start_offset)
+        first_pages = []
+        offsets = range(start_offset, total_records, 1000)
+    else:
+        # the probe already returned the page at offset 0
+        first_pages = [(0, response.get('items', []))]
+        offsets = range(1000, total_records, 1000)
+    if listing_concurrency > 1:
+        pages = iter_listing_pages_concurrently(listing_url, params, offsets, listing_concurrency)
+    else:
+        pages = ((offset, fetch_listing_page(listing_url, params, offset)) for offset in offsets)
+
+    seen = CompactIds()
+    for offset, items in chain(first_pages, pages):
+        ids = [i['id'] for i in items]
+        if shard is not None:
+            # every shard reads the whole listing, which is cheap next to the detail requests it skips
+            ids = [id for id in ids if shard_of(id, shard[1]) == shard[0]]
+        # offset paging can repeat ids when records move between pages mid-listing
+        ids = [id for id in ids if id not in seen]
+        seen.update(ids)
+        if checkpoint is not None:
+            ids = checkpoint.listed(offset, ids)
+        for id in ids:
+            yield id
+
+
+class Checkpoint:
+    """Progress of a long extraction saved to S3 (or a local directory) so a later run can --resume it"""
+
+    def __init__(self, location, service, interval=300, suffix=''):
+        self.location = location
+        self.service = service
+        self.name = service + suffix + ".json"
+        self.interval = float(interval)
+        self.params = None
+        self.offset = 0
+        self.delivered = CompactIds()
+        # ids listed but not yet shipped, and how many of them each listing page still owes
+        self.in_flight = {}
+        self.page_pending = {}
+        self.next_offset = 0
+        self.last_save = time.monotonic()
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Read the last checkpoint, returning False when there is none"""
+        body = read_state(self.location, self.name)
+        if body is None:
+            return False
+        state = json.loads(body)
+        self.params = state['params']
+        self.offset = self.next_offset = state['offset']
+        self.delivered = CompactIds(state['delivered'])
+        return True
+
+    def listed(self, offset, ids):
+        """Register a listing page and return the ids on it that still need delivering"""
+        with self.lock:
+            pending = [id for id in ids if id not in self.delivered]
+            for id in pending:
+                self.in_flight[id] = offset
+            if pending:
+                self.page_pending[offset] = self.page_pending.get(offset, 0) + len(pending)
+            self.next_offset = max(self.next_offset, offset + 1000)
+            return pending
+
+    def mark_delivered(self, id):
+        with self.lock:
+            self.delivered.add(id)
+            offset = self.in_flight.pop(id, None)
+            if offset is not None:
+                self.page_pending[offset] -= 1
+                if self.page_pending[offset] == 0:
+                    del self.page_pending[offset]
+
+    def due(self):
+        return time.monotonic() - self.last_save >= self.interval
+
+    def save(self):
+        """Persist progress; callers flush the Firehose sink first so every delivered id is durable"""
+        with self.lock:
+            # resume from the earliest page that still has undelivered ids
+            offset = min(self.page_pending) if self.page_pending else self.next_offset
+            body = json.dumps({
+                "service": self.service,
+                "params": self.params,
+                "offset": offset,
+                "delivered": list(self.delivered)
+            })
+        write_state(self.location, self.name, body)
+        self.last_save = time.monotonic()
+        print("Checkpoint saved at offset", offset, "with", len(self.delivered), "delivered ids")
+
+    def clear(self):
+        delete_state(self.location, self.name)
+
+
+class Watermark:
+    """Highest lastModifiedDate delivered per service, so incremental runs only ask for newer records"""
+    pattern = re.compile(rb'"lastModifiedDate"\s*:\s*"([^"]+)"')
+
+    def __init__(self, location, service, overlap_minutes=60):
+        self.location = location
+        self.service = service
+        self.name = service + ".json"
+        self.overlap = timedelta(minutes=float(overlap_minutes))
+        self.value = None
+        self.max_seen = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        body = read_state(self.location, self.name)
+        if body is not None:
+            self.value = json.loads(body)['lastModifiedDate']
+        return self.value
+
+    def observe(self, data):
+        match = self.pattern.search(data)
+        if match:
+            # NetSuite returns lastModifiedDate as ISO-8601 UTC, so string order is time order
+            value = match.group(1).decode('ascii')
+            with self.lock:
+                if self.max_seen is None or value > self.max_seen:
+                    self.max_seen = value
+
+    def since(self):
+        """Start of the next query window in the account's time zone, or None before the first watermark"""
+        if self.value is None:
+            return None
+        value = datetime.fromisoformat(self.value.replace("Z", "+00:00"))
+        return (value - self.overlap).astimezone(netsuite_timezone)
+
+    def save(self):
+        if self.max_seen is None or (self.value is not None and self.max_seen <= self.value):
+            return
+        write_state(self.location, self.name,
+                    json.dumps({"service": self.service, "lastModifiedDate": self.max_seen}))
+        print("Watermark for", self.service, "advanced to", self.max_seen)
+        self.value = self.max_seen
+
+
+class SqliteState:
+    """SQLite database kept between runs under an s3:// prefix (through a local copy) or in a local directory"""
+
+    def __init__(self, location, name):
+        self.location = location
+        self.name = name
+        if location.startswith("s3://"):
+            self.path = os.path.join(tempfile.gettempdir(), self.name)
         else:
-            param_offset = {
-                'q': f'lastModifiedDate ON_OR_AFTER "' + yesterday + '" AND lastModifiedDate BEFORE "' + today + '"',
-                'offset': offset
-            }
-        response = get_response(url, params=param_offset)
-        print("::::: Response with offset: ", response)
-        dict_response = json.loads(response)
+            self.path = os.path.join(location, self.name)
+        self.db = None
+
+    def connect(self):
+        if self.location.startswith("s3://"):
+            body = read_state(self.location, self.name)
+            with open(self.path, 'wb') as f:
+                f.write(body or b'')
+        else:
+            os.makedirs(self.location, exist_ok=True)
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+
+    def save(self):
+        """Commit this run's changes; finish only calls it once the records behind them have reached the sink"""
+        self.db.commit()
+        self.db.close()
+        if self.location.startswith("s3://"):
+            with open(self.path, 'rb') as f:
+                write_state(self.location, self.name, f.read())
+
+    def discard(self):
+        self.db.rollback()
+        self.db.close()
+
+
+class ChangeIndex(SqliteState):
+    """Per-service SQLite index of record id to payload hash, used to drop unchanged records before Firehose"""
+    # fields that change on touch-only modifications without altering the business record
+    volatile_fields = ('links', 'lastModifiedDate')
+
+    def __init__(self, location, service, suppress=True):
+        super().__init__(location, service + ".sqlite")
+        self.suppress = suppress
+        self.suppressing = suppress
+        self.new = 0
+        self.changed = 0
+        self.unchanged = 0
+
+    def open(self):
+        self.connect()
+        self.db.execute("CREATE TABLE IF NOT EXISTS record_hash (id TEXT PRIMARY KEY, hash INTEGER NOT NULL) WITHOUT ROWID")
+        # a full load rebuilds the tables, so it ships every record and only refreshes the hashes
+        self.suppressing = self.suppress and fullload != "1"
+
+    @classmethod
+    def fingerprint(cls, data):
+        record = parse_json(data)
+        for field in cls.volatile_fields:
+            record.pop(field, None)
+        normalized = json.dumps(record, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        return int.from_bytes(hashlib.blake2b(normalized, digest_size=8).digest(), 'big', signed=True)
+
+    def is_unchanged(self, id, data):
+        """Record the payload's hash, returning whether the record can be dropped as unchanged"""
+        fingerprint = self.fingerprint(data)
+        row = self.db.execute("SELECT hash FROM record_hash WHERE id = ?", (id,)).fetchone()
+        if row is not None and row[0] == fingerprint:
+            self.unchanged += 1
+            return self.suppressing
+        if row is None:
+            self.new += 1
+        else:
+            self.changed += 1
+        self.db.execute("INSERT OR REPLACE INTO record_hash (id, hash) VALUES (?, ?)", (id, fingerprint))
+        return False
+
+    def save(self):
+        super().save()
+        print("Change suppression: new", self.new, "changed", self.changed,
+              "unchanged dropped" if self.suppressing else "unchanged shipped", self.unchanged)
+
+
+# SuiteQL tables and columns per service; references come back as {"id", "refName"} like the REST record API
+suiteql_queries = {
+    'customer': {
+        'table': 'customer',
+        'columns': ['id', 'entityid', 'companyname', 'email', 'phone', 'altphone', 'fax', 'url', 'comments',
+                    'creditlimit', 'datecreated', 'lastmodifieddate', 'startdate'],
+        'booleans': ['isinactive', 'isperson'],
+        'references': ['currency', 'subsidiary', 'terms', 'salesrep', 'entitystatus', 'receivablesaccount'],
+    },
+    'subsidiary': {
+        'table': 'subsidiary',
+        'columns': ['id', 'name', 'legalname', 'email', 'url', 'lastmodifieddate'],
+        'booleans': ['iselimination', 'isinactive'],
+        'references': ['country', 'currency', 'parent'],
+    },
+    'employee': {
+        'table': 'employee',
+        'columns': ['id', 'entityid', 'firstname', 'middlename', 'lastname', 'email', 'phone', 'mobilephone',
+                    'title', 'hiredate', 'releasedate', 'datecreated', 'lastmodifieddate'],
+        'booleans': ['isinactive', 'issalesrep', 'isjobresource', 'giveaccess'],
+        'references': ['department', 'location', 'subsidiary', 'supervisor', 'employeetype'],
+    },
+    'vendor': {
+        'table': 'vendor',
+        'columns': ['id', 'entityid', 'companyname', 'legalname', 'firstname', 'lastname', 'email', 'phone',
+                    'altphone', 'fax', 'url', 'comments', 'creditlimit', 'datecreated', 'lastmodifieddate'],
+        'booleans': ['isinactive', 'isperson'],
+        'references': ['currency', 'subsidiary', 'category', 'terms', 'expenseaccount'],
+    },
+    'vendorsubsidiaryrelationship': {
+        'table': 'vendorsubsidiaryrelationship',
+        'columns': ['id', 'creditlimit', 'lastmodifieddate'],
+        'booleans': ['isprimarysub'],
+        'references': ['entity', 'subsidiary', 'basecurrency', 'primarycurrency'],
+    },
+}
+for transaction_service, transaction_type in [('purchaseorder', 'PurchOrd'), ('invoice', 'CustInvc'),
+                                              ('creditmemo', 'CustCred'), ('customerpayment', 'CustPymt'),
+                                              ('journalentry', 'Journal'), ('vendorbill', 'VendBill')]:
+    suiteql_queries[transaction_service] = {
+        'table': 'transaction',
+        'type': transaction_type,
+        'columns': ['id', 'tranid', 'trandate', 'duedate', 'memo', 'exchangerate', 'createddate',
+                    'lastmodifieddate'],
+        'booleans': [],
+        'references': ['currency', 'entity', 'postingperiod', 'status', 'approvalstatus'],
+    }
+
+
+def suiteql_statement(config, after_id):
+    """Build a keyset-paged SuiteQL query so deep pages never need a large offset"""
+    select = config['columns'] + config['booleans']
+    for reference in config['references']:
+        select += [reference, 'BUILTIN.DF(' + reference + ') AS ' + reference + '_refname']
+    conditions = ['id > ' + str(after_id)]
+    if 'type' in config:
+        conditions.append("type = '" + config['type'] + "'")
+    if fullload != "1":
+        conditions.append("lastmodifieddate >= TO_DATE('" + yesterday + "', 'DD/MM/YYYY')")
+        conditions.append("lastmodifieddate < TO_DATE('" + today + "', 'DD/MM/YYYY')")
+    return ('SELECT ' + ', '.join(select) + ' FROM ' + config['table'] +
+            ' WHERE ' + ' AND '.join(conditions) + ' ORDER BY id')
+
+
+def suiteql_row_to_record(row, config):
+    row.pop('links', None)
+    for column in config['booleans']:
+        if column in row:
+            row[column] = row[column] == 'T'
+    for reference in config['references']:
+        ref_name = row.pop(reference + '_refname', None)
+        if reference in row:
+            row[reference] = {"id": str(row[reference]), "refName": ref_name}
+    return row
+
+
+def suiteql_page(statement, offset=0, page_size=1000):
+    """POST one page of a SuiteQL query, retried like every other NetSuite request"""
+    attempt = 0
+    while True:
         try:
-            dict_response['items']
-        except:
-            print("Exceeds request limit, please try again after sometime")
+            response = client.post(suiteql_url, params={'limit': page_size, 'offset': offset},
+                                   json={'q': statement}, headers={'Prefer': 'transient'})
+            status, body = response.status_code, response.content
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        except Exception as e:
+            status, body, retry_after = None, str(e).encode('utf-8'), 0
+        if status == 200:
+            return parse_json(body)
+        attempt += 1
+        if not is_retryable(status, body) or attempt >= retries.max_attempts:
+            raise RuntimeError("SuiteQL query failed with status " + str(status) + ": " +
+                               body.decode('utf-8', 'replace'))
+        metrics.count('Retries', Service=metric_service(suiteql_url))
+        time.sleep(retries.delay(attempt, retry_after))
+
+
+def iter_suiteql_records(page_size=1000):
+    config = suiteql_queries[service]
+    after_id = 0
+    while True:
+        print("suiteql after id: ", after_id)
+        try:
+            dict_response = suiteql_page(suiteql_statement(config, after_id), page_size=page_size)
+            items = dict_response['items']
+        except (RuntimeError, KeyError) as e:
+            print(e)
             sys.exit(1)
-        # print(response)
+        for row in items:
+            yield suiteql_row_to_record(row, config)
+        if not dict_response.get('hasMore') or not items:
+            break
+        after_id = int(items[-1]['id'])
+
 
-        j = 0
-        for i in dict_response['items']:
-            id = i['id']
-            url_with_id = url + "/" + id
-            url_list.append(url_with_id)
-            j = j + 1
-        offset = offset + 1000
-    return url_list
+def run_suiteql():
+    """Extract the service through SuiteQL pages and ship every row to the Firehose sink"""
+    total = 0
+    for record in iter_suiteql_records():
+        put_kinesis_firehose(json.dumps(record))
+        total += 1
+    return total
+
+
+class DeletedRecords:
+    """Tombstones for the records of a service deleted since its last run, read from SuiteQL's DeletedRecord table"""
+    timestamp_format = '%Y-%m-%d %H:%M:%S'
+
+    def __init__(self, location, service, overlap_minutes=60):
+        self.location = location
+        self.service = service
+        self.name = service + ".deletes.json"
+        self.overlap = timedelta(minutes=float(overlap_minutes))
+        self.since = None
+        self.started = None
+        self.shipped = 0
+        self.failed = False
+
+    def load(self):
+        self.started = datetime.now(timezone.utc)
+        body = read_state(self.location, self.name)
+        if body is not None:
+            self.since = datetime.fromisoformat(json.loads(body)['since'].replace("Z", "+00:00")) - self.overlap
+        else:
+            # the first run looks back as far as the record listings do
+            self.since = datetime.combine(prevday, datetime.min.time(), netsuite_timezone)
+        return self.since
+
+    def statement(self):
+        since = self.since.astimezone(netsuite_timezone).strftime(self.timestamp_format)
+        # DeletedRecord.type is the record type, compared without case, spaces or dashes
+        return ("SELECT recordid, TO_CHAR(deleteddate, 'YYYY-MM-DD HH24:MI:SS') AS deleteddate FROM deletedrecord"
+                " WHERE REPLACE(REPLACE(LOWER(type), ' ', ''), '-', '') = '" + self.service + "'"
+                " AND deleteddate >= TO_TIMESTAMP('" + since + "', 'YYYY-MM-DD HH24:MI:SS')"
+                " ORDER BY deleteddate, recordid")
+
+    def tombstones(self, page_size=1000):
+        offset = 0
+        while True:
+            page = suiteql_page(self.statement(), offset, page_size)
+            for row in page.get('items', []):
+                deleted = datetime.strptime(row['deleteddate'], self.timestamp_format).replace(tzinfo=netsuite_timezone)
+                # recordType rather than type, which several tables already use for the record's own type field
+                yield {"id": str(row['recordid']), "recordType": self.service,
+                       "deletedDate": deleted.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'), "Op": "D"}
+            if not page.get('hasMore') or not page.get('items'):
+                break
+            offset += page_size
+
+    def save(self):
+        """Move the next run's window up to this run's start"""
+        write_state(self.location, self.name, json.dumps({
+            "service": self.service, "since": self.started.strftime('%Y-%m-%dT%H:%M:%SZ'), "shipped": self.shipped}))
 
 
 def return_headers_auth(url):
@@ -211,35 +1636,839 @@ def return_headers_auth(url):
     return headers_auth
 
 
+def get_catalog_table(glue, name):
+    """The Glue catalog table Firehose converts the service with, or None when the service has none"""
+    try:
+        return glue.get_table(DatabaseName=optional_args['gluedatabase'], Name=name)['Table']
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'EntityNotFoundException':
+            return None
+        raise
+
+
+class ResponseCache(SqliteState):
+    """Per-service SQLite cache of record bodies, so slow-changing records are served without a NetSuite round trip"""
+
+    def __init__(self, location, service, ttl_hours=24, probe=True, overlap_minutes=60):
+        super().__init__(location, service + ".cache.sqlite")
+        self.service = service
+        self.ttl = float(ttl_hours) * 3600
+        self.probe_changes = probe
+        self.overlap = timedelta(minutes=float(overlap_minutes))
+        self.lock = threading.Lock()
+        self.started = None
+        # bodies fetched before the listing window may predate the modification that listed their record
+        self.fresh_after = 0.0
+        self.serving = True
+        self.probe_failed = False
+        self.hits = 0
+        self.misses = 0
+
+    def open(self, listing_url, window_start=None):
+        """Load the cache for a listing of the records modified since window_start, None for a full listing"""
+        self.connect()
+        self.db.execute("CREATE TABLE IF NOT EXISTS response (id TEXT PRIMARY KEY, fetched REAL NOT NULL, "
+                        "body BLOB NOT NULL) WITHOUT ROWID")
+        self.db.execute("CREATE TABLE IF NOT EXISTS probe (probed REAL NOT NULL)")
+        self.started = time.time()
+        self.fresh_after = max(self.started - self.ttl, window_start.timestamp() if window_start else 0.0)
+        # a full load refetches everything, refreshing the cache as it goes
+        self.serving = fullload != "1"
+        if self.serving and self.probe_changes:
+            self.probe(listing_url)
+
+    def probe(self, listing_url):
+        """Ask NetSuite in one listing request which records changed since the last completed run's probe, and
+        evict them: a later run whose listing window still covers a change must not find the old body"""
+        probed = self.db.execute("SELECT max(probed) FROM probe").fetchone()[0]
+        if probed is None:
+            return
+        since = (datetime.fromtimestamp(probed, timezone.utc) - self.overlap).astimezone(netsuite_timezone)
+        query = 'lastModifiedDate ON_OR_AFTER "' + since.strftime(netsuite_datetime_format) + '"'
+        status, body, _ = request_record(listing_url, {'q': query, 'limit': 1000})
+        response = parse_json(body) if status == 200 else {}
+        items = response.get('items', [])
+        if 'totalResults' not in response or response['totalResults'] > len(items):
+            # keep the old probe time so the next run's probe still covers this one
+            print("Change probe for", self.service, "got status", status, "with", response.get('totalResults'),
+                  "changes, fetching every record")
+            self.serving = False
+            self.probe_failed = True
+            return
+        with self.lock:
+            self.db.executemany("DELETE FROM response WHERE id = ?", [(item['id'],) for item in items])
+        print("Change probe for", self.service, ":", len(items), "records modified since",
+              since.strftime(netsuite_datetime_format))
+
+    def get(self, id):
+        if not self.serving:
+            return None
+        with self.lock:
+            row = self.db.execute("SELECT fetched, body FROM response WHERE id = ?", (id,)).fetchone()
+            if row is None or row[0] < self.fresh_after:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return zlib.decompress(row[1])
+
+    def put(self, id, body):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO response (id, fetched, body) VALUES (?, ?, ?)",
+                            (id, time.time(), zlib.compress(body)))
+
+    def save(self):
+        with self.lock:
+            if not self.probe_failed:
+                self.db.execute("DELETE FROM probe")
+                self.db.execute("INSERT INTO probe (probed) VALUES (?)", (self.started,))
+            super().save()
+        print("Response cache for", self.service, ": hits", self.hits, "misses", self.misses)
+
+    def discard(self):
+        with self.lock:
+            super().discard()
+
+
+class FieldProjection:
+    """Trims a service's records to its Glue catalog columns and asks NetSuite for only those fields"""
+    # kept whether or not they are columns, for record urls, watermarks and failure reports
+    required_fields = ('id', 'lastModifiedDate')
+
+    def __init__(self, service, columns, request_fields=False, metadata_url=None):
+        self.service = service
+        self.columns = frozenset([column.lower() for column in columns] +
+                                 [field.lower() for field in self.required_fields])
+        self.request_fields = request_fields and metadata_url is not None
+        self.metadata_url = metadata_url
+        # comma separated field list for the record requests, set by load_field_names
+        self.fields = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def load_field_names(self):
+        """Spell the lower-case catalog columns exactly as NetSuite does, from the record type's metadata catalog"""
+        if not self.request_fields:
+            return
+        try:
+            response = client.request("GET", self.metadata_url, headers={'Accept': 'application/schema+json'})
+            properties = parse_json(response.content).get('properties') if response.status_code == 200 else None
+            problem = "status " + str(response.status_code)
+        except Exception as e:
+            properties, problem = None, str(e)
+        if not properties:
+            self.request_fields = False
+            print("No metadata catalog for", self.service, "(" + problem + "), fetching whole records and trimming them")
+            return
+        names = {name.lower(): name for name in properties}
+        # columns the record type does not define, such as o:errorDetails, are never requested
+        self.fields = ",".join(sorted(names[column] for column in self.columns if column in names)) or None
+        print("Requesting", self.service, "fields:", self.fields)
+
+    def trim(self, data):
+        record = parse_json(data)
+        kept = {key: value for key, value in record.items() if key.lower() in self.columns}
+        self.bytes_in += len(data)
+        if len(kept) < len(record):
+            data = json.dumps(kept, separators=(',', ':')).encode('utf-8')
+        self.bytes_out += len(data)
+        return data
+
+    def stop_requesting(self, fields):
+        if self.request_fields:
+            self.request_fields = False
+            self.fields = None
+            print("NetSuite rejected the", self.service, "field list", fields, ", fetching whole records")
+
+
+class ServiceExtraction:
+    """One service's part of a run: its record listing, the packer for its Firehose stream and its incremental state"""
+
+    def __init__(self, service, url, packer, weight=1, expand=False, watermark=None, change_index=None,
+                 checkpoint=None, shard=None, projection=None, cache=None, deletes=None):
+        self.service = service
+        self.url = url
+        self.packer = packer
+        self.weight = float(weight)
+        self.expand = expand
+        self.watermark = watermark
+        self.change_index = change_index
+        self.checkpoint = checkpoint
+        self.shard = shard
+        self.projection = projection
+        self.cache = cache
+        self.deletes = deletes
+        self.params = None
+        self.start_offset = 0
+        self.prepared = False
+        self.records = 0
+        # ids that still failed after their retries; URLs are only built when reporting them
+        self.failed = CompactIds()
+
+    def prepare(self):
+        """Load the watermark, change index, response cache and checkpoint before the service's listing starts"""
+        if self.watermark is not None and fullload != "1":
+            print("Watermark for", self.service, ":", self.watermark.load())
+        if self.change_index is not None:
+            self.change_index.open()
+        if self.projection is not None:
+            self.projection.load_field_names()
+        if self.checkpoint is not None and optional_args['resume'] == '1' and self.checkpoint.load():
+            self.params = self.checkpoint.params
+            self.start_offset = self.checkpoint.offset
+            print("Resuming", self.service, "from checkpoint with", len(self.checkpoint.delivered),
+                  "ids already delivered")
+        else:
+            self.params = listing_params(self.watermark)
+            if self.checkpoint is not None:
+                self.checkpoint.params = self.params
+        if self.cache is not None:
+            self.cache.open(self.url, listing_window_start(self.params))
+        self.prepared = True
+
+    def iter_ids(self, listing_concurrency=1):
+        return iter_listing_ids(self.url, listing_concurrency, self.params, self.start_offset, self.checkpoint,
+                                self.watermark, self.shard)
+
+    def record_url(self, id):
+        return self.url + "/" + id
+
+    def failed_urls(self):
+        return [self.record_url(id) for id in self.failed]
+
+    def fetch(self, id):
+        """GET one record, asking for the catalog columns only once the projection has their NetSuite spellings"""
+        if self.cache is not None:
+            body = self.cache.get(id)
+            if body is not None:
+                metrics.count('CacheHits', Service=self.service)
+                return 200, body, 0
+        url_with_id = self.record_url(id)
+        fields = self.projection.fields if self.projection is not None else None
+        status, body, retry_after = get_record(url_with_id, self.expand, fields)
+        if status == 400 and fields:
+            # an unknown field name fails the whole request; stop projecting if the record is fine without it
+            status, body, retry_after = get_record(url_with_id, self.expand)
+            if status == 200:
+                self.projection.stop_requesting(fields)
+        if status == 200 and self.cache is not None:
+            self.cache.put(id, body)
+        return status, body, retry_after
+
+    def ship(self, id, data, ok):
+        if not ok:
+            self.failed.add(id)
+        if self.watermark is not None:
+            self.watermark.observe(data)
+        if ok and self.projection is not None:
+            data = self.projection.trim(data)
+        if not (ok and self.change_index is not None and self.change_index.is_unchanged(id, data)):
+            self.packer.put(data)
+        # failed ids stay in flight, so a resumed run lists their page again and retries them
+        if ok and self.checkpoint is not None:
+            self.checkpoint.mark_delivered(id)
+        self.records += 1
+        metrics.count('Records', Service=self.service)
+
+    def ship_deletes(self):
+        """Ship a tombstone for every record of the service NetSuite deleted since the last run"""
+        if self.deletes is None:
+            return 0
+        print("Shipping", self.service, "records deleted since", self.deletes.load())
+        try:
+            for tombstone in self.deletes.tombstones():
+                self.packer.put(json.dumps(tombstone, separators=(',', ':')))
+                self.deletes.shipped += 1
+        except Exception as e:
+            # the records are already shipped; only the deletes window stays put, so the next run asks again
+            self.deletes.failed = True
+            print("Deletes stage for", self.service, "failed:", e)
+            sentry_sdk.capture_message(self.service + " deletes stage failed with error:" + str(e))
+        metrics.count('Tombstones', self.deletes.shipped, Service=self.service)
+        return self.deletes.shipped
+
+    def sink_failed(self):
+        return self.packer.sink.records_failed > 0
+
+    def missed_records(self):
+        """Whether any record of the run may not have been delivered: a failed listing page, a record that ran out
+        of retries or a record the sink dropped"""
+        return bool(self.failed) or self.sink_failed() or self.url in url_not_200
+
+    def save_checkpoint_if_due(self):
+        if self.checkpoint is not None and self.checkpoint.due():
+            if self.packer.flush_on_interval:
+                self.packer.flush()
+            elif self.packer.buffered():
+                # the Parquet sink checkpoints between files instead of cutting a short one
+                return
+            self.save_checkpoint()
+
+    def save_checkpoint(self):
+        """Save progress unless the sink has dropped records, which the checkpoint cannot tell apart from
+        delivered ones; the last checkpoint saved before the drop stays in place for --resume"""
+        if self.sink_failed():
+            print("Not checkpointing", self.service, "after", self.packer.sink.records_failed,
+                  "records failed to reach the sink")
+            self.checkpoint.last_save = time.monotonic()
+            return
+        self.checkpoint.save()
+
+    def finish(self, completed):
+        """Commit or roll back the incremental state; called after the service's packer and sink are closed"""
+        if not self.prepared:
+            return
+        print("Service", self.service, "records shipped:", self.records)
+        if self.projection is not None and self.projection.bytes_in:
+            print("Projection for", self.service, "kept", self.projection.bytes_out // 1024, "KB of",
+                  self.projection.bytes_in // 1024, "KB")
+        # a shard only sees part of the service, so the combined run summary advances the watermark
+        if completed and self.watermark is not None and self.shard is None:
+            if self.missed_records():
+                # moving past a missed record would skip it for good; the next run's window still covers it
+                print("Keeping the", self.service, "watermark: some records were not delivered")
+            else:
+                self.watermark.save()
+        if self.change_index is not None and self.change_index.db is not None:
+            if completed and not self.sink_failed():
+                self.change_index.save()
+            else:
+                self.change_index.discard()
+        if self.deletes is not None and self.deletes.started is not None:
+            if completed and not self.deletes.failed and not self.sink_failed():
+                self.deletes.save()
+            print("Tombstones shipped for", self.service, ":", self.deletes.shipped)
+        if self.cache is not None and self.cache.db is not None:
+            if completed and not self.sink_failed():
+                self.cache.save()
+            else:
+                self.cache.discard()
+        if self.checkpoint is not None:
+            if completed and not self.sink_failed():
+                self.checkpoint.clear()
+            else:
+                self.save_checkpoint()
+
+
+class FairScheduler:
+    """Weighted fair sharing of the fetch workers between services, charged by how long their requests take"""
+
+    def __init__(self, queue_size):
+        self.queue_size = queue_size
+        self.queues = {}
+        self.weights = {}
+        self.passes = {}
+        self.costs = {}
+        self.virtual_time = 0.0
+        self.condition = threading.Condition()
+
+    def add(self, name, weight=1):
+        self.queues[name] = deque()
+        self.weights[name] = float(weight)
+        self.passes[name] = 0.0
+        self.costs[name] = 1.0
+
+    def put(self, name, item):
+        """Queue work for a service, blocking while that service's own queue is full"""
+        with self.condition:
+            while len(self.queues[name]) >= self.queue_size:
+                self.condition.wait()
+            if not self.queues[name]:
+                # a service coming back from idle starts at the current virtual time instead of banking credit
+                self.passes[name] = max(self.passes[name], self.virtual_time)
+            self.queues[name].append(item)
+            self.condition.notify_all()
+
+    def get(self, timeout):
+        """Return (name, item) from the backlogged service furthest behind its weighted share"""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                ready = [name for name, pending in self.queues.items() if pending]
+                if ready:
+                    name = min(ready, key=self.passes.__getitem__)
+                    self.virtual_time = self.passes[name]
+                    # charge the expected cost up front so concurrent workers spread across services
+                    self.passes[name] += self.costs[name] / self.weights[name]
+                    item = self.queues[name].popleft()
+                    self.condition.notify_all()
+                    return name, item
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise queue.Empty
+                self.condition.wait(remaining)
+
+    def completed(self, name, elapsed):
+        """Fold a finished request's duration into the service's expected cost"""
+        with self.condition:
+            self.costs[name] += 0.2 * (elapsed - self.costs[name])
+
+
+def run_pipeline(sources, workers, queue_size, flush_interval):
+    """Stream (extraction, ids) sources into shared detail workers and the Firehose packers,
+    returning the number of records fetched"""
+    scheduler = FairScheduler(queue_size)
+    by_service = {}
+    for extraction, _ in sources:
+        scheduler.add(extraction.service, extraction.weight)
+        by_service[extraction.service] = extraction
+    packers = list(dict.fromkeys(extraction.packer for extraction in by_service.values()))
+    record_queue = queue.Queue(maxsize=queue_size)
+    errors = []
+    fetched = [0] * workers
+    # URLs handed to the workers that have not been shipped or given up on yet, retries included
+    outstanding = [0]
+    listings_running = [len(sources)]
+    outstanding_lock = threading.Lock()
+
+    def produce(extraction, ids):
+        try:
+            for id in ids:
+                if errors:
+                    # the run is failing, so stop listing records whose details would only be thrown away
+                    break
+                with outstanding_lock:
+                    outstanding[0] += 1
+                scheduler.put(extraction.service, id)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            with outstanding_lock:
+                listings_running[0] -= 1
+
+    def finished():
+        with outstanding_lock:
+            # a failing run stops once its listings do, leaving queued ids and pending retries unfetched
+            return listings_running[0] == 0 and (outstanding[0] == 0 or bool(errors))
+
+    def fetch(worker):
+        while not finished():
+            item = retries.pop_due()
+            if item is None:
+                try:
+                    name, id = scheduler.get(timeout=0.2)
+                except queue.Empty:
+                    continue
+                extraction, attempt = by_service[name], 0
+            else:
+                (extraction, id), attempt = item
+            if errors:
+                # keep taking ids so blocked listings can see the failure, but spend no NetSuite requests on them
+                with outstanding_lock:
+                    outstanding[0] -= 1
+                continue
+            try:
+                url_with_id = extraction.record_url(id)
+                started = time.monotonic()
+                status, body, retry_after = extraction.fetch(id)
+                scheduler.completed(extraction.service, time.monotonic() - started)
+                if status != 200:
+                    if is_retryable(status, body) and retries.schedule((extraction, id), attempt + 1, retry_after):
+                        metrics.count('Retries', Service=extraction.service)
+                        continue
+                    metrics.count('RequestsFailed', Service=extraction.service)
+                    body = error_output(url_with_id, body)
+                record_queue.put((extraction, id, body, status == 200))
+                fetched[worker] += 1
+            except Exception as e:
+                # the run fails once the workers drain; a dead worker would leave its URL outstanding forever
+                errors.append(e)
+            with outstanding_lock:
+                outstanding[0] -= 1
+
+    def ship():
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = record_queue.get(timeout=1)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            if errors:
+                # keep draining so fetch workers never block on a dead sink
+                continue
+            try:
+                if item:
+                    extraction, id, data, ok = item
+                    extraction.ship(id, data, ok)
+                for extraction in by_service.values():
+                    extraction.save_checkpoint_if_due()
+                if time.monotonic() - last_flush >= flush_interval:
+                    for packer in packers:
+                        if packer.flush_on_interval:
+                            packer.flush()
+                    last_flush = time.monotonic()
+            except Exception as e:
+                errors.append(e)
+
+    producers = [threading.Thread(target=produce, args=(extraction, ids), name="listing-" + extraction.service)
+                 for extraction, ids in sources]
+    fetchers = [threading.Thread(target=fetch, args=(i,), name="fetch-" + str(i)) for i in range(workers)]
+    shipper = threading.Thread(target=ship, name="firehose")
+    for thread in producers + [shipper] + fetchers:
+        thread.start()
+    for thread in producers + fetchers:
+        thread.join()
+    record_queue.put(None)
+    shipper.join()
+    if errors:
+        raise errors[0]
+    return sum(fetched)
+
+
 def main(urls):
-    for url in urls:
-        response = get_response(url=url, params="")
-        put_kinesis_firehose(response)
-        # print(response)
+    """Fetch and ship an explicit list of record URLs for the job's service on a single worker"""
+    ids = (url_with_id.rsplit("/", 1)[1] for url_with_id in urls)
+    return run_pipeline([(extractions[0], ids)], workers=1, queue_size=int(optional_args['queuesize']),
+                        flush_interval=float(optional_args['flushinterval']))
+
+
+def shard_summary_name(index, count):
+    return service + "/" + run_id + "/shard-" + str(index) + "-of-" + str(count) + ".json"
+
+
+def new_run_id():
+    return datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ') + "-" + uuid.uuid4().hex[:8]
+
+
+def write_shard_summary(completed, seconds):
+    """Record what this shard delivered so the run's shards can be combined into one summary"""
+    index, count = shard
+    body = json.dumps({
+        "service": service,
+        "run_id": run_id,
+        "shard": index,
+        "shards": count,
+        "completed": completed,
+        "seconds": round(seconds, 1),
+        "retries": retries.retried,
+        "throttled": client.governor.throttled,
+        "firehose_failed": sum(p.sink.records_failed for p in dict.fromkeys(e.packer for e in extractions)),
+        "listing_failed": url_not_200,
+        "services": {
+            extraction.service: {
+                "records": extraction.records,
+                "failed_ids": list(extraction.failed),
+                "max_last_modified": extraction.watermark.max_seen if extraction.watermark is not None else None
+            } for extraction in extractions
+        }
+    })
+    write_state(run_summary_location, shard_summary_name(index, count), body)
+
+
+def combine_shard_summaries(count):
+    """Merge the run's shard summaries once all of them exist, advancing watermarks if every shard completed;
+    returns None when a summary is missing or another shard of the run already combined them"""
+    names = [shard_summary_name(i, count) for i in range(count)]
+    bodies = [read_state(run_summary_location, name) for name in names]
+    if any(body is None for body in bodies):
+        return None
+    # shards finishing together can all see every summary; the conditional write elects one of them to combine
+    if not create_state(run_summary_location, service + "/" + run_id + "/combined.lock", run_id):
+        return None
+    shards = [json.loads(body) for body in bodies]
+    combined = {
+        "service": service,
+        "run_id": run_id,
+        "shards": count,
+        "completed": all(s["completed"] for s in shards),
+        "incomplete_shards": [s["shard"] for s in shards if not s["completed"]],
+        "seconds": max(s["seconds"] for s in shards),
+        "records": sum(v["records"] for s in shards for v in s["services"].values()),
+        "retries": sum(s["retries"] for s in shards),
+        "throttled": sum(s["throttled"] for s in shards),
+        "firehose_failed": sum(s["firehose_failed"] for s in shards),
+        "services": {}
+    }
+    failed_urls = sorted(set(url for s in shards for url in s["listing_failed"]))
+    for extraction in extractions:
+        results = [s["services"][extraction.service] for s in shards]
+        failed = [id for result in results for id in result["failed_ids"]]
+        failed_urls += [extraction.record_url(id) for id in failed]
+        missed = failed or combined["firehose_failed"] > 0 or extraction.url in failed_urls
+        combined["services"][extraction.service] = {
+            "records": sum(result["records"] for result in results),
+            "failed": len(failed)
+        }
+        seen = [result["max_last_modified"] for result in results if result["max_last_modified"]]
+        if combined["completed"] and extraction.watermark is not None and seen and not missed:
+            extraction.watermark.load()
+            extraction.watermark.max_seen = max(seen)
+            extraction.watermark.save()
+    combined["failed_urls"] = failed_urls
+    write_state(run_summary_location, service + "/" + run_id + "/summary.json", json.dumps(combined))
+    for name in names:
+        delete_state(run_summary_location, name)
+    return combined
+
+
+def report_combined_summary(combined):
+    print("Combined summary of", combined["shards"], "shards for", service, "run", run_id, ":",
+          json.dumps({k: v for k, v in combined.items() if k != "failed_urls"}))
+    if combined["failed_urls"]:
+        print("Url failed after retrying:", combined["failed_urls"])
+        sentry_sdk.capture_message("netsuite url failed after retrying:" + str(combined["failed_urls"]))
+    if not combined["completed"]:
+        sentry_sdk.capture_message(service + " shards " + str(combined["incomplete_shards"]) + " of run " +
+                                   run_id + " did not complete")
+
+
+def without_options(argv, names):
+    """Copy of argv without the given --name value pairs"""
+    stripped = [argv[0]]
+    skip = False
+    for arg in argv[1:]:
+        if skip:
+            skip = False
+        elif arg.startswith('--') and arg[2:] in names:
+            skip = True
+        else:
+            stripped.append(arg)
+    return stripped
+
+
+def run_shard_processes(argv, count):
+    """Run each of the count shards as a child process of this job and wait for all of them"""
+    base = without_options(argv, ('shard', 'runid'))
+    children = [
+        subprocess.Popen([sys.executable] + base + ['--shard', str(i) + '/' + str(count), '--runid', run_id])
+        for i in range(count)
+    ]
+    return [child.wait() for child in children]
+
+
+def shards_exit_code(exit_codes, combined):
+    """Exit status of a --shards run: it fails like the unsharded job would when any shard failed or is missing"""
+    if any(exit_codes) or combined is None or not combined["completed"]:
+        return 1
+    return 0
+
+
+def init_job(argv, secrets=None):
+    """Resolve the job arguments and build the clients, sinks and state shared by every stage of the run"""
+    global region_name, service, fullload, optional_args, netsuite_timezone
+    global account_id, consumer_key, consumer_secret, token, token_secret, suiteql_url, signer
+    global client, sink, packer, retries, max_expanded_bytes, extractions, metrics
+    global shard, run_id, run_summary_location
+    optional_args = get_optional_args(argv, optional_arg_defaults)
+    # --services extracts several services in one run, each shipped to the stream named in --serviceconfig
+    services = [name.strip() for name in optional_args['services'].split(',') if name.strip()]
+    required = ['secretmanager', 'region', 'fullload']
+    if not services:
+        required += ['kinesisfirehose', 'service']
+    args = getResolvedOptions(argv, required)
+    region_name = str(args['region'])
+    fullload = args['fullload']
+    netsuite_timezone = ZoneInfo(optional_args['timezone'])
+    if services:
+        service_config = json.loads(optional_args['serviceconfig'] or '{}')
+        missing = [name for name in services if name not in service_config]
+        if missing:
+            raise SystemExit("No Firehose stream configured in --serviceconfig for: " + ", ".join(missing))
+        if optional_args['mode'] == 'suiteql':
+            raise SystemExit("--mode suiteql extracts a single --service")
+        service_config = {name: service_config[name] for name in services}
+        service = ",".join(services)
+    else:
+        service = str(args['service'])
+        service_config = {service: {'stream': str(args['kinesisfirehose'])}}
+    shard = parse_shard(optional_args['shard']) if optional_args['shard'] else None
+    # shards started as separate Glue runs find each other's summaries through the run id they are all given;
+    # otherwise every invocation gets its own, so summaries of earlier runs are never mixed in
+    if shard and not optional_args['runid']:
+        raise SystemExit("--shard needs the --runid shared by all shards of the run")
+    run_id = optional_args['runid'] or new_run_id()
+    run_summary_location = optional_args['runsummary'] or optional_args['checkpoint'] or tempfile.gettempdir()
+    suffix = ".shard-" + str(shard[0]) + "-of-" + str(shard[1]) if shard else ''
+    if shard and optional_args['hashindex']:
+        print("Change suppression is off for sharded runs: shards cannot share one change index file")
+    if shard and optional_args['responsecache']:
+        print("The response cache is off for sharded runs: shards cannot share one cache file")
+    cache_config = dict(response_cache_services, **json.loads(optional_args['cacheconfig'] or '{}'))
+
+    if secrets is None:
+        secrets = getSecrets(str(args['secretmanager']), region_name)
+    account_id = secrets["accountid"]
+    consumer_key = secrets["consumer_key"]
+    consumer_secret = secrets["consumer_secret"]
+    token = secrets["token"]
+    token_secret = secrets["token_secret"]
+    suiteql_url = secrets["url"].split("record/v1")[0] + "query/v1/suiteql"
+    signer = OAuth1Signer(account_id, consumer_key, consumer_secret, token, token_secret)
+    metrics = Metrics(exporter=optional_args['metrics'], interval=optional_args['metricsinterval'])
+
+    client = NetSuiteClient(
+        signer,
+        pool_size=optional_args['poolsize'],
+        connect_timeout=optional_args['connecttimeout'],
+        read_timeout=optional_args['readtimeout'],
+        governor=ConcurrencyGovernor(
+            initial=int(optional_args['concurrency']),
+            maximum=int(optional_args['maxconcurrency'])
+        ),
+        leases=AccountConcurrencyLeases(
+            optional_args['leasetable'],
+            slots=optional_args['accountconcurrency'],
+            ttl=optional_args['leasettl']
+        ) if optional_args['leasetable'] else None,
+        metrics=metrics
+    )
+    retries = RetrySchedule(
+        max_attempts=optional_args['maxattempts'],
+        base=optional_args['retrybase'],
+        cap=optional_args['retrycap']
+    )
+    max_expanded_bytes = int(optional_args['maxexpandedsize']) * 1024
+
+    # services sharing a delivery stream share its packer, and all streams share one Firehose client
+    firehose = boto3.client('firehose', region_name=region_name)
+    packers = {}
+    extractions = []
+    parquet = optional_args['sink'] == 'parquet'
+    projection = optional_args['projection'] if optional_args['mode'] != 'suiteql' else 'off'
+    if parquet and not import_pyarrow():
+        raise SystemExit("--sink parquet needs pyarrow in --additional-python-modules")
+    use_catalog = parquet or projection != 'off'
+    if use_catalog:
+        glue = boto3.client('glue', region_name=region_name)
+        s3 = boto3.client('s3', region_name=region_name)
+    for name, config in service_config.items():
+        stream = config['stream']
+        # the Glue table Firehose converts with gives the columns, S3 location and partition keys
+        table = get_catalog_table(glue, name) if use_catalog else None
+        if table is None and parquet:
+            raise SystemExit("No Glue table " + optional_args['gluedatabase'] + "." + name + " to write Parquet for")
+        if table is None and use_catalog:
+            print("No Glue table for", name, ", shipping its records unprojected")
+        if parquet:
+            stream = 'parquet:' + name
+            packers[stream] = ParquetSink(
+                table,
+                target_bytes=int(optional_args['parquetsize']) * 1024 * 1024,
+                s3=s3,
+                metrics=metrics
+            )
+        elif stream not in packers:
+            packers[stream] = RecordPacker(FirehoseSink(stream, firehose=firehose, metrics=metrics),
+                                           max_bytes=int(optional_args['packsize']) * 1024)
+        extractions.append(ServiceExtraction(
+            name,
+            secrets["url"] + name,
+            packers[stream],
+            weight=config.get('weight', 1),
+            expand=expand_sub_resources_for(name),
+            watermark=Watermark(
+                optional_args['watermark'],
+                name,
+                overlap_minutes=optional_args['watermarkoverlap']
+            ) if optional_args['watermark'] else None,
+            # Parquet backfills rewrite the tables' files, so they keep unchanged records too
+            change_index=ChangeIndex(optional_args['hashindex'], name, suppress=not parquet)
+            if optional_args['hashindex'] and not shard else None,
+            checkpoint=Checkpoint(
+                optional_args['checkpoint'],
+                name,
+                interval=optional_args['checkpointinterval'],
+                suffix=suffix
+            ) if optional_args['checkpoint'] else None,
+            shard=shard,
+            projection=FieldProjection(
+                name,
+                [column['Name'] for column in table['StorageDescriptor']['Columns']],
+                request_fields=projection == 'fields',
+                metadata_url=secrets["url"] + "metadata-catalog/" + name
+            ) if projection != 'off' and table is not None else None,
+            cache=ResponseCache(
+                optional_args['responsecache'],
+                name,
+                ttl_hours=cache_config[name].get('ttl_hours', 24),
+                probe=cache_config[name].get('probe', True),
+                overlap_minutes=optional_args['watermarkoverlap']
+            ) if optional_args['responsecache'] and name in cache_config and not shard else None,
+            # the whole feed is small, so only the first shard reads it
+            deletes=DeletedRecords(
+                optional_args['deletes'],
+                name,
+                overlap_minutes=optional_args['watermarkoverlap']
+            ) if optional_args['deletes'] and (not shard or shard[0] == 0) else None
+        ))
+    # the SuiteQL path ships through the single service's packer
+    packer = extractions[0].packer
+    sink = packer.sink
+
 
 if __name__ == "__main__":
-    print("Calling service:", service)
-    urls = return_url_list()
+    if sentry_dsn:
+        sentry_sdk.init(
+            dsn=sentry_dsn,
+            integrations=[
+                AwsLambdaIntegration(),
+            ],
+            traces_sample_rate=1.0,
+        )
+    init_job(sys.argv)
+    shard_count = int(optional_args['shards'])
+    if shard is None and shard_count > 1:
+        print("Calling service:", service, "as", shard_count, "shard processes, run", run_id)
+        exit_codes = run_shard_processes(sys.argv, shard_count)
+        print("Shard exit codes:", exit_codes)
+        combined = combine_shard_summaries(shard_count)
+        if combined is None:
+            sentry_sdk.capture_message(service + " run " + run_id + " is missing shard summaries")
+        else:
+            report_combined_summary(combined)
+        sys.exit(shards_exit_code(exit_codes, combined))
 
+    print("Calling service:", service, "shard " + optional_args['shard'] if shard else "")
+    metrics.start()
+    started = time.monotonic()
+    completed = False
     try:
-        if len(urls) > 0:
-            print("Total number of items to process: ", len(urls))
-            main(urls)
-            i = 0
-            while i < 5 and len(url_not_200) > 0:
-                time.sleep(5)
-                print(len(url_not_200)," url failed Retying attempt:", i+1,)
-                retry_urls = url_not_200
-                url_not_200 = []
-                main(retry_urls)
-                i = i +1
-                if i == 5:
-                    print("Url failed after retrying 5 times:", url_not_200)
-                    error_msg = "netsuite url after retrying 5 times:" + str(url_not_200)
+        if optional_args['mode'] == 'suiteql':
+            total = run_suiteql()
+        else:
+            for extraction in extractions:
+                extraction.prepare()
+            listing_concurrency = int(optional_args['listingconcurrency'])
+            total = run_pipeline(
+                [(extraction, extraction.iter_ids(listing_concurrency)) for extraction in extractions],
+                workers=int(optional_args['maxconcurrency']),
+                queue_size=int(optional_args['queuesize']),
+                flush_interval=float(optional_args['flushinterval'])
+            )
+            for extraction in extractions:
+                extraction.ship_deletes()
+        if total > 0:
+            print("Total number of items processed: ", total, "retries scheduled:", retries.retried)
+            failed_urls = url_not_200 + [url for extraction in extractions for url in extraction.failed_urls()]
+            if len(failed_urls) > 0:
+                print("Url failed after retrying:", failed_urls)
+                # shard failures are reported once, by the combined summary
+                if shard is None:
+                    error_msg = "netsuite url failed after retrying:" + str(failed_urls)
                     sentry_sdk.capture_message(error_msg)
 
         else:
             print("No records to process!")
+        completed = True
     except Exception as e:
-        error_msg = service + " failed with error:" + e
+        error_msg = service + " failed with error:" + str(e)
         sentry_sdk.capture_message(error_msg)
+    finally:
+        print("Concurrency limit at end of run:", client.governor.current_limit,
+              "throttled responses:", client.governor.throttled,
+              "lease waits:", client.leases.waits if client.leases else 0)
+        for stream_packer in dict.fromkeys(extraction.packer for extraction in extractions):
+            stream_packer.close()
+            stream_packer.sink.close()
+        client.close()
+        for extraction in extractions:
+            extraction.finish(completed)
+        metrics.close()
+        if shard is not None:
+            write_shard_summary(completed, time.monotonic() - started)
+            # shards started as separate Glue runs combine themselves: the last one to finish writes the summary
+            if shard_count <= 1:
+                combined = combine_shard_summaries(shard[1])
+                if combined is not None:
+                    report_combined_summary(combined)
@@ -0,0 +1,99 @@
+"""Throughput benchmark of the NetSuite extractor modes against the local fake NetSuite server
+
+Each mode runs the real job script in a subprocess. NetSuite, Firehose and Secrets Manager are all served by
+fake_netsuite.FakeNetSuite through AWS_ENDPOINT_URL, and benchmarks/stubs stands in for Glue's awsglue package.
+
+    sequential  GlueJob-netsuite-get-restApi.py with one worker and no record packing
+    async       netsuite_call_api_scripts/net-suite-get-api-gluejob-script.py (aiohttp, PutRecord per record)
+    batched     GlueJob-netsuite-get-restApi.py with concurrent workers, packing and PutRecordBatch
+
+    python benchmarks/extractor_benchmark.py --records 5000 --latency lognormal:80,0.5 --throttle-rate 0.01
+
+Reported per mode: delivered records/s (wall clock, including interpreter start-up), p50/p99 delivery latency
+(from the fake serving a record to that record reaching the Firehose stand-in), 429s served, Firehose calls
+and the job process's peak RSS.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+from fake_netsuite import FakeNetSuite
+
+repo = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+glue_job = os.path.join(repo, "GlueJob-netsuite-get-restApi.py")
+async_job = os.path.join(repo, "netsuite_call_api_scripts", "net-suite-get-api-gluejob-script.py")
+stubs = os.path.join(repo, "benchmarks", "stubs")
+
+
+def mode_command(mode, service, concurrency):
+    common = ["--kinesisfirehose", "netsuite-benchmark-" + service, "--secretmanager", "netsuite/benchmark",
+              "--region", "eu-west-1", "--service", service, "--fullload", "1"]
+    if mode == "sequential":
+        return [glue_job] + common + ["--concurrency", "1", "--maxconcurrency", "1", "--packsize", "0",
+                                      "--metrics", "off"]
+    if mode == "async":
+        return [async_job] + common + ["--concurrency", str(concurrency)]
+    if mode == "batched":
+        return [glue_job] + common + ["--concurrency", str(concurrency), "--maxconcurrency", str(concurrency),
+                                      "--listingconcurrency", "2", "--metrics", "off"]
+    raise ValueError("unknown mode: " + mode)
+
+
+def run_mode(fake, mode, service, concurrency, log):
+    env = dict(os.environ,
+               AWS_ENDPOINT_URL=fake.url,
+               AWS_ACCESS_KEY_ID="benchmark",
+               AWS_SECRET_ACCESS_KEY="benchmark",
+               AWS_DEFAULT_REGION="eu-west-1",
+               PYTHONPATH=os.pathsep.join(filter(None, [stubs, os.environ.get("PYTHONPATH")])),
+               SENTRY_DSN="")
+    fake.reset()
+    started = time.monotonic()
+    process = subprocess.Popen([sys.executable] + mode_command(mode, service, concurrency),
+                               stdout=log, stderr=subprocess.STDOUT, env=env, cwd=repo)
+    # wait4 gives the resource usage of this child alone
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.monotonic() - started
+    stats = fake.stats()
+    stats.update({
+        "mode": mode,
+        "exit": process.returncode,
+        "seconds": round(elapsed, 2),
+        "records_per_second": round(stats["delivered"] / elapsed, 1),
+        # ru_maxrss is in KiB on Linux and bytes on macOS
+        "peak_rss_mb": round(usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1),
+    })
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modes", default="sequential,async,batched")
+    parser.add_argument("--service", default="customer")
+    parser.add_argument("--records", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--latency", default="lognormal:80,0.5", help="detail latency in ms")
+    parser.add_argument("--listing-latency", default="fixed:300", help="listing page latency in ms")
+    parser.add_argument("--payload", default="fixed:2000", help="detail payload size in bytes")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of detail requests given 429")
+    parser.add_argument("--concurrency-limit", type=int, default=0, help="429 above this many requests in flight")
+    parser.add_argument("--log", default=os.devnull, help="file collecting the job scripts' output")
+    options = parser.parse_args()
+
+    fake = FakeNetSuite(options.records, options.latency, options.listing_latency, options.payload,
+                        options.throttle_rate, options.concurrency_limit).start()
+    columns = ["mode", "exit", "seconds", "delivered", "records_per_second", "delivery_p50_ms",
+               "delivery_p99_ms", "throttled", "firehose_calls", "peak_rss_mb"]
+    print(" ".join("%18s" % column for column in columns))
+    with open(options.log, "a") as log:
+        for mode in options.modes.split(","):
+            stats = run_mode(fake, mode, options.service, options.concurrency, log)
+            print(" ".join("%18s" % stats[column] for column in columns), flush=True)
+    fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+"""Local stand-in for the NetSuite REST record API, Firehose and Secrets Manager used by the extractor benchmarks
+
+NetSuite:   GET /services/rest/record/v1/<service>?offset=  (totalResults/items listing, 1000 per page)
+            GET /services/rest/record/v1/<service>/<id>     (record detail, honouring ?fields=)
+            GET /services/rest/record/v1/metadata-catalog/<service>  (JSON schema of the record's fields)
+            POST /services/rest/query/v1/suiteql?limit=&offset=     (keyset-paged SuiteQL over the same ids,
+                                                                     deletedrecord rows from FakeNetSuite.deleted)
+AWS:        POST / with X-Amz-Target Firehose_20150804.PutRecord[Batch] or secretsmanager.GetSecretValue,
+            so the job scripts run unchanged with AWS_ENDPOINT_URL pointing here.
+
+Run on its own for manual testing:
+    python benchmarks/fake_netsuite.py --records 20000 --latency lognormal:80,0.6 --throttle-rate 0.01
+"""
+import argparse
+import base64
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+record_path = "/services/rest/record/v1/"
+suiteql_path = "/services/rest/query/v1/suiteql"
+
+
+def parse_distribution(spec):
+    """Sampler for 'fixed:50', 'uniform:20,200' or 'lognormal:80,0.5' (median, sigma)"""
+    kind, _, values = spec.partition(":")
+    numbers = [float(v) for v in values.split(",")]
+    if kind == "fixed":
+        return lambda: numbers[0]
+    if kind == "uniform":
+        return lambda: random.uniform(numbers[0], numbers[1])
+    if kind == "lognormal":
+        return lambda: random.lognormvariate(math.log(numbers[0]), numbers[1])
+    raise ValueError("unknown distribution: " + spec)
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class FakeNetSuite:
+    """Serves NetSuite-shaped listings and records with configurable latency, payload size and throttling"""
+
+    def __init__(self, records=5000, latency="lognormal:80,0.5", listing_latency="fixed:300",
+                 payload="fixed:2000", throttle_rate=0.0, concurrency_limit=0, retry_after=1, port=0,
+                 throttle_first=0):
+        self.records = int(records)
+        self.latency = parse_distribution(latency)
+        self.listing_latency = parse_distribution(listing_latency)
+        self.payload = parse_distribution(payload)
+        self.throttle_rate = float(throttle_rate)
+        self.concurrency_limit = int(concurrency_limit)
+        self.retry_after = retry_after
+        # the first throttle_first NetSuite requests of every kind are answered with 429
+        self.throttle_first = int(throttle_first)
+        # rows of the deletedrecord table: {"recordid", "deleteddate" as YYYY-MM-DD HH24:MI:SS, "type"}
+        self.deleted = []
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.reset()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self.handler())
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.url = "http://127.0.0.1:" + str(self.port)
+
+    def reset(self):
+        with self.lock:
+            self.served = {}
+            self.delivery_latencies = []
+            self.detail_requests = 0
+            self.listing_requests = 0
+            self.suiteql_requests = 0
+            self.forced_throttles = self.throttle_first
+            self.throttled = 0
+            self.firehose_calls = 0
+            self.firehose_records = 0
+            self.delivered = set()
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="fake-netsuite", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "detail_requests": self.detail_requests,
+                "listing_requests": self.listing_requests,
+                "suiteql_requests": self.suiteql_requests,
+                "throttled": self.throttled,
+                "firehose_calls": self.firehose_calls,
+                "firehose_records": self.firehose_records,
+                "delivered": len(self.delivered),
+                "delivery_p50_ms": round(percentile(self.delivery_latencies, 0.5) * 1000, 1),
+                "delivery_p99_ms": round(percentile(self.delivery_latencies, 0.99) * 1000, 1),
+            }
+
+    def secret(self, service_url):
+        return {
+            "accountid": "1234567_SB1", "consumer_key": "ck", "consumer_secret": "cs",
+            "token": "tk", "token_secret": "ts", "url": service_url
+        }
+
+    def listing(self, service, query):
+        offset = int(query.get("offset", ["0"])[0])
+        limit = int(query.get("limit", ["1000"])[0])
+        ids = range(offset + 1, min(offset + limit, self.records) + 1)
+        return {
+            "links": [], "count": len(ids), "hasMore": offset + limit < self.records, "offset": offset,
+            "totalResults": self.records,
+            "items": [{"links": [{"rel": "self", "href": self.url + record_path + service + "/" + str(i)}],
+                       "id": str(i)} for i in ids]
+        }
+
+    def detail(self, service, id, fields=None):
+        record = {
+            "links": [{"rel": "self", "href": self.url + record_path + service + "/" + id}],
+            "id": id,
+            "entityId": service.upper() + "-" + id,
+            "lastModifiedDate": "2024-01-%02dT%02d:%02d:00Z" % (1 + int(id) % 28, int(id) % 24, int(id) % 60),
+            "subsidiary": {"links": [], "id": "1", "refName": "Parent Company"},
+            "memo": "",
+        }
+        padding = int(self.payload()) - len(json.dumps(record))
+        if padding > 0:
+            record["memo"] = "x" * padding
+        if fields:
+            # like NetSuite, ?fields= keeps the named fields and the links
+            wanted = set(fields.split(",")) | {"links"}
+            record = {key: value for key, value in record.items() if key in wanted}
+        return record
+
+    def suiteql_value(self, column, columns, id):
+        if column == "id":
+            return str(id)
+        if column.endswith("_refname"):
+            return "Name " + str(id % 5 + 1)
+        if column + "_refname" in columns:
+            return str(id % 5 + 1)
+        if column.startswith("is"):
+            return "T" if id % 2 else "F"
+        if "date" in column:
+            return "%02d/01/2024" % (1 + id % 28)
+        return column + "-" + str(id)
+
+    def suiteql(self, statement, query):
+        """One page of a SuiteQL query: every selected column of ids 1..records after the query's 'id > n'"""
+        offset = int(query.get("offset", ["0"])[0])
+        limit = int(query.get("limit", ["1000"])[0])
+        select, _, rest = statement[len("SELECT "):].partition(" FROM ")
+        if rest.split()[0].lower() == "deletedrecord":
+            rows = [dict(row, links=[]) for row in self.deleted]
+        else:
+            columns = [column.rsplit(" AS ", 1)[-1].strip().lower() for column in select.split(", ")]
+            after = re.search(r"\bid > (\d+)", rest)
+            first = int(after.group(1)) + 1 if after else 1
+            rows = [dict({column: self.suiteql_value(column, columns, id) for column in columns}, links=[])
+                    for id in range(first, self.records + 1)]
+        page = rows[offset:offset + limit]
+        return {"links": [], "count": len(page), "hasMore": offset + limit < len(rows), "offset": offset,
+                "totalResults": len(rows), "items": page}
+
+    def forced_throttle(self):
+        with self.lock:
+            if self.forced_throttles <= 0:
+                return False
+            self.forced_throttles -= 1
+            return True
+
+    def deliver(self, data):
+        """Match records arriving at the Firehose stand-in against the time their detail was served"""
+        now = time.monotonic()
+        for line in data.splitlines():
+            if not line.strip():
+                continue
+            try:
+                id = json.loads(line).get("id")
+            except ValueError:
+                continue
+            with self.lock:
+                self.firehose_records += 1
+                served = self.served.pop(id, None)
+                if served is not None:
+                    self.delivery_latencies.append(now - served)
+                    self.delivered.add(id)
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body go out in separate writes; with Nagle on, keep-alive clients wait ~40 ms for the body
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status, body, headers=()):
+                data = body if isinstance(body, bytes) else json.dumps(body).encode()
+                self.send_response(status)
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                if not parts.path.startswith(record_path):
+                    return self.reply(404, {"title": "Not Found"})
+                with fake.lock:
+                    fake.in_flight += 1
+                    over_limit = 0 < fake.concurrency_limit < fake.in_flight
+                try:
+                    service, _, id = parts.path[len(record_path):].partition("/")
+                    if service == "metadata-catalog":
+                        # JSON schema of the record type, whose property names the extractor requests ?fields= by
+                        return self.reply(200, {"type": "object", "properties": {
+                            name: {} for name in fake.detail(id, "1")}})
+                    if over_limit or fake.forced_throttle() or (id and random.random() < fake.throttle_rate):
+                        with fake.lock:
+                            fake.throttled += 1
+                        return self.reply(429, {"o:errorDetails": [{"o:errorCode": "CONCURRENCY_LIMIT_EXCEEDED"}]},
+                                          [("Retry-After", str(fake.retry_after))])
+                    if not id:
+                        time.sleep(fake.listing_latency() / 1000)
+                        with fake.lock:
+                            fake.listing_requests += 1
+                        return self.reply(200, fake.listing(service, parse_qs(parts.query)))
+                    time.sleep(fake.latency() / 1000)
+                    if not id.isdigit() or int(id) > fake.records:
+                        return self.reply(404, {"o:errorDetails": [{"o:errorCode": "NONEXISTENT_ID"}]})
+                    body = json.dumps(fake.detail(service, id, parse_qs(parts.query).get("fields", [None])[0])).encode()
+                    with fake.lock:
+                        fake.detail_requests += 1
+                        fake.served.setdefault(id, time.monotonic())
+                    return self.reply(200, body)
+                finally:
+                    with fake.lock:
+                        fake.in_flight -= 1
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                parts = urlsplit(self.path)
+                if parts.path == suiteql_path:
+                    if fake.forced_throttle():
+                        with fake.lock:
+                            fake.throttled += 1
+                        return self.reply(429, {"o:errorDetails": [{"o:errorCode": "CONCURRENCY_LIMIT_EXCEEDED"}]},
+                                          [("Retry-After", str(fake.retry_after))])
+                    time.sleep(fake.listing_latency() / 1000)
+                    with fake.lock:
+                        fake.suiteql_requests += 1
+                    return self.reply(200, fake.suiteql(body["q"], parse_qs(parts.query)))
+                target = self.headers.get("X-Amz-Target", "")
+                headers = [("Content-Type", "application/x-amz-json-1.1")]
+                if target == "secretsmanager.GetSecretValue":
+                    return self.reply(200, {
+                        "ARN": "arn:aws:secretsmanager:eu-west-1:123456789012:secret:" + body["SecretId"],
+                        "Name": body["SecretId"], "VersionId": str(uuid.uuid4()),
+                        "SecretString": json.dumps(fake.secret(fake.url + record_path))
+                    }, headers)
+                if target == "Firehose_20150804.PutRecord":
+                    with fake.lock:
+                        fake.firehose_calls += 1
+                    fake.deliver(base64.b64decode(body["Record"]["Data"]))
+                    return self.reply(200, {"RecordId": uuid.uuid4().hex, "Encrypted": False}, headers)
+                if target == "Firehose_20150804.PutRecordBatch":
+                    with fake.lock:
+                        fake.firehose_calls += 1
+                    for record in body["Records"]:
+                        fake.deliver(base64.b64decode(record["Data"]))
+                    return self.reply(200, {
+                        "FailedPutCount": 0, "Encrypted": False,
+                        "RequestResponses": [{"RecordId": uuid.uuid4().hex} for _ in body["Records"]]
+                    }, headers)
+                return self.reply(400, {"__type": "UnknownOperationException", "message": target}, headers)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--records", type=int, default=5000)
+    parser.add_argument("--latency", default="lognormal:80,0.5", help="detail latency in ms")
+    parser.add_argument("--listing-latency", default="fixed:300", help="listing page latency in ms")
+    parser.add_argument("--payload", default="fixed:2000", help="detail payload size in bytes")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of detail requests given 429")
+    parser.add_argument("--concurrency-limit", type=int, default=0, help="429 above this many requests in flight")
+    options = parser.parse_args()
+    fake = FakeNetSuite(options.records, options.latency, options.listing_latency, options.payload,
+                        options.throttle_rate, options.concurrency_limit, port=options.port).start()
+    print("Fake NetSuite listening on", fake.url + record_path)
+    try:
+        while True:
+            time.sleep(10)
+            print(json.dumps(fake.stats()))
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
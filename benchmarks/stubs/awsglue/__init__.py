@@ -0,0 +1 @@
+"""Minimal stand-in for the awsglue package of the Glue runtime, so the job scripts run locally unchanged"""
@@ -0,0 +1,8 @@
+def getResolvedOptions(argv, options):
+    """Resolve --name value arguments the way Glue does, failing on a missing one"""
+    resolved = {}
+    for name in options:
+        if '--' + name not in argv or argv.index('--' + name) + 1 >= len(argv):
+            raise SystemExit("argument --" + name + " is required")
+        resolved[name] = argv[argv.index('--' + name) + 1]
+    return resolved
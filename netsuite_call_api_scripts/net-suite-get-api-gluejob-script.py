@@ -12,7 +12,6 @@ import boto3
 import aiohttp
 import asyncio
 from datetime import date, timedelta, datetime
-from asyncio_throttle import Throttler
 import attr
 from awsglue.utils import getResolvedOptions
 from botocore.exceptions import ClientError
@@ -26,7 +25,23 @@ service = str(args['service'])
 fullload = args['fullload']
 prevday = date.today() + timedelta(days=-1)
 current_date = str(prevday.strftime("%d/%m/%Y"))
-limit, rate = 10, 5
+url_not_200 = []
+
+
+def get_optional_args(argv, defaults):
+    """Resolve optional Glue job arguments, falling back to the given defaults"""
+    present = [name for name in defaults if '--' + name in argv]
+    resolved = getResolvedOptions(argv, present) if present else {}
+    return {name: resolved.get(name, default) for name, default in defaults.items()}
+
+
+# concurrency is the number of simultaneous requests our NetSuite account allows this job
+optional_args = get_optional_args(sys.argv, {
+    'concurrency': 5,
+    'connecttimeout': 5,
+    'readtimeout': 60,
+})
+concurrency = int(optional_args['concurrency'])
 def getSecrets(secretmanager,region):
 
     # Create a Secrets Manager client
@@ -65,19 +80,24 @@ auth = OAuth1(
     resource_owner_secret = token_secret,
     signature_method="HMAC-SHA256"
     )
+firehose = boto3.client('firehose', region_name=region_name)
 
 @attr.s
 class Fetch:
-    limit = attr.ib()
-    rate = attr.ib(default=5, converter=int)
+    session = attr.ib()
+    semaphore = attr.ib()
 
-    async def fetch(self, url, limit, headers_auth):
-        async with self.limit:
-            async with aiohttp.ClientSession() as session:
-                async with session.request("GET", url, headers=headers_auth) as response:
-                    await response.text()
-                    print(url, response.status)
-                    await asyncio.sleep(self.rate)
+    async def fetch(self, url):
+        async with self.semaphore:
+            headers_auth = return_headers_auth(url)
+            async with self.session.get(url, headers=headers_auth) as response:
+                body = await response.text()
+                status = response.status
+        print(url, status)
+        if status != 200:
+            url_not_200.append(url)
+            return
+        await asyncio.get_running_loop().run_in_executor(None, put_kinesis_firehose, body)
 
 
 def generateNonce(length=11):
@@ -119,7 +139,6 @@ def get_response(url, params):
 
 
 def put_kinesis_firehose(data):
-    firehose = boto3.client('firehose')
     stream_name = kinesisfirehose_name
     # stream_name = 'json_stream'
     # Put the data to the delivery stream
@@ -199,15 +218,26 @@ def return_headers_auth(url):
     return headers_auth
 
 
-async def main(urls, rate, limit):
-    # limit = asyncio.Semaphore(limit)
-    limit = Throttler(rate_limit=limit, period=rate)
-    f = Fetch(rate=rate, limit=limit)
-    tasks = []
-    for url in urls:
-        headers_auth = return_headers_auth(url)
-        tasks.append(f.fetch(url=url, limit=limit, headers_auth=headers_auth))
-    results = await asyncio.gather(*tasks)
+async def main(urls, concurrency):
+    connector = aiohttp.TCPConnector(
+        limit=concurrency,
+        limit_per_host=concurrency,
+        ttl_dns_cache=300,
+        keepalive_timeout=60,
+        enable_cleanup_closed=True
+    )
+    timeout = aiohttp.ClientTimeout(
+        sock_connect=float(optional_args['connecttimeout']),
+        sock_read=float(optional_args['readtimeout'])
+    )
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        f = Fetch(session=session, semaphore=asyncio.Semaphore(concurrency))
+        tasks = [f.fetch(url=url) for url in urls]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+    for url, result in zip(urls, results):
+        if isinstance(result, Exception):
+            print(url, "failed with error:", result)
+            url_not_200.append(url)
 
 
 '''
@@ -221,6 +251,8 @@ if __name__ == "__main__":
     urls = return_url_list()
     if len(urls) > 0:
         print("Total number of items to process: ", len(urls))
-        asyncio.run(main(urls, rate=rate, limit=limit))
+        asyncio.run(main(urls, concurrency=concurrency))
+        if len(url_not_200) > 0:
+            print(len(url_not_200), "url failed:", url_not_200)
     else:
         print("No records to process!")
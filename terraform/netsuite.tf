@@ -43,13 +43,62 @@ resource "aws_glue_job" "create_gluejob_netsuite" {
   default_arguments = {
     "--region"          = var.AWS_DEFAULT_REGION
     "--secretmanager"   = "netsuite/credentials"
-    "--additional-python-modules" = "sentry-sdk, requests_oauthlib"
+    ## backfill runs started with --sink parquet pass this list plus pyarrow, which the hourly runs do not load
+    "--additional-python-modules" = "sentry-sdk, requests_oauthlib, orjson"
     "--fullload" = 0
     "--python-modules-installer-option" = "--upgrade"
+    "--leasetable" = aws_dynamodb_table.create_lease_table_netsuite.name
+    "--checkpoint" = "s3://${aws_s3_bucket.netsuite_staging_bucket.bucket}/checkpoints/"
+    "--watermark" = "s3://${aws_s3_bucket.netsuite_staging_bucket.bucket}/watermarks/"
+    "--hashindex" = "s3://${aws_s3_bucket.netsuite_staging_bucket.bucket}/hashindex/"
+    "--runsummary" = "s3://${aws_s3_bucket.netsuite_staging_bucket.bucket}/runs/"
+    ## ship only the Glue catalog columns of each service, asking NetSuite for just those fields
+    "--projection" = "fields"
+    ## slow-changing reference services are served from this cache within their TTL
+    "--responsecache" = "s3://${aws_s3_bucket.netsuite_staging_bucket.bucket}/responsecache/"
+    ## tombstones for records deleted since the last run, shipped after each service's records
+    "--deletes" = "s3://${aws_s3_bucket.netsuite_staging_bucket.bucket}/deletes/"
+    ## service -> delivery stream and scheduling weight, used when a run is started with --services a,b,c
+    "--serviceconfig" = jsonencode({
+      for name, stream in {
+        customer                     = aws_kinesis_firehose_delivery_stream.create_firehose_customer_netsuite.name
+        purchaseorder                = aws_kinesis_firehose_delivery_stream.create_firehose_purchaseorder_netsuite.name
+        subsidiary                   = aws_kinesis_firehose_delivery_stream.create_firehose_subsidiary_netsuite.name
+        creditmemo                   = aws_kinesis_firehose_delivery_stream.create_firehose_creditmemo_netsuite.name
+        customerpayment              = aws_kinesis_firehose_delivery_stream.create_firehose_customerpayment_netsuite.name
+        employee                     = aws_kinesis_firehose_delivery_stream.create_firehose_employee_netsuite.name
+        invoice                      = aws_kinesis_firehose_delivery_stream.create_firehose_invoice_netsuite.name
+        journalentry                 = aws_kinesis_firehose_delivery_stream.create_firehose_journalentry_netsuite.name
+        vendor                       = aws_kinesis_firehose_delivery_stream.create_firehose_vendor_netsuite.name
+        vendorbill                   = aws_kinesis_firehose_delivery_stream.create_firehose_vendorbill_netsuite.name
+        vendorsubsidiaryrelationship = aws_kinesis_firehose_delivery_stream.create_firehose_vendorsubsidiaryrelationship_netsuite.name
+      } : name => { stream = stream, weight = 1 }
+    })
   }
 
 }
 
+## Account-wide NetSuite concurrency slots shared by all parallel Glue job runs
+resource "aws_dynamodb_table" "create_lease_table_netsuite" {
+  name         = "netsuite-concurrency-leases"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "lease_slot"
+
+  attribute {
+    name = "lease_slot"
+    type = "N"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+
+  tags = {
+    CreatedBy = "Terraform"
+  }
+}
+
 ## Create Glue job IAM role
 resource "aws_iam_role" "create_iam_role_glue_netsuite" {
   name = "netsuite-glue-role"
@@ -87,6 +136,10 @@ resource "aws_iam_role_policy_attachment" "cloudwatch_full_access_to_glue" {
   policy_arn = "arn:aws:iam::aws:policy/CloudWatchFullAccess"
   role       = aws_iam_role.create_iam_role_glue_netsuite.name
 }
+resource "aws_iam_role_policy_attachment" "dynamodb_full_access_to_glue" {
+  policy_arn = "arn:aws:iam::aws:policy/AmazonDynamoDBFullAccess"
+  role       = aws_iam_role.create_iam_role_glue_netsuite.name
+}
 resource "aws_iam_role_policy_attachment" "glue_full_access_to_glue" {
   policy_arn = "arn:aws:iam::aws:policy/service-role/AWSGlueServiceRole"
   role       = aws_iam_role.create_iam_role_glue_netsuite.name
@@ -705,6 +758,18 @@ resource "aws_glue_catalog_table" "create_table_customer_netsuite" {
       name = "startdate"
       type = "string"
     }
+    columns {
+      name = "recordtype"
+      type = "string"
+    }
+    columns {
+      name = "deleteddate"
+      type = "string"
+    }
+    columns {
+      name = "op"
+      type = "string"
+    }
 
   }
 }
@@ -1092,6 +1157,18 @@ resource "aws_glue_catalog_table" "create_table_purchaseorder_netsuite" {
  columns{
     name =  "message"
     type =  "string"
+  }
+ columns{
+    name =  "recordtype"
+    type =  "string"
+  }
+ columns{
+    name =  "deleteddate"
+    type =  "string"
+  }
+ columns{
+    name =  "op"
+    type =  "string"
   }
     # Add more columns as needed
   }
@@ -1205,6 +1282,18 @@ resource "aws_glue_catalog_table" "create_table_subsidiary_netsuite" {
  columns{
  name = "url"
  type = "string"
+ }
+ columns{
+ name = "recordtype"
+ type = "string"
+ }
+ columns{
+ name = "deleteddate"
+ type = "string"
+ }
+ columns{
+ name = "op"
+ type = "string"
  }
   }
 }
@@ -1473,6 +1562,18 @@ resource "aws_glue_catalog_table" "create_table_creditmemo_netsuite" {
   columns{
     name =  "o:errordetails"
     type =  "array<struct<detail:string,errorCode:string>>"
+  }
+  columns{
+    name =  "recordtype"
+    type =  "string"
+  }
+  columns{
+    name =  "deleteddate"
+    type =  "string"
+  }
+  columns{
+    name =  "op"
+    type =  "string"
   }
    }
 }
@@ -1657,6 +1758,18 @@ resource "aws_glue_catalog_table" "create_table_customerpayment_netsuite" {
   columns{
     name =  "o:errordetails"
     type =  "array<struct<detail:string,errorCode:string>>"
+  }
+  columns{
+    name =  "recordtype"
+    type =  "string"
+  }
+  columns{
+    name =  "deleteddate"
+    type =  "string"
+  }
+  columns{
+    name =  "op"
+    type =  "string"
   }
    }
 }
@@ -1989,6 +2102,18 @@ resource "aws_glue_catalog_table" "create_table_employee_netsuite" {
   columns{
     name =  "releasedate"
     type =  "string"
+  }
+  columns{
+    name =  "recordtype"
+    type =  "string"
+  }
+  columns{
+    name =  "deleteddate"
+    type =  "string"
+  }
+  columns{
+    name =  "op"
+    type =  "string"
   }
    }
 }
@@ -2282,6 +2407,18 @@ resource "aws_glue_catalog_table" "create_table_invoice_netsuite" {
     name =  "custbody_nexus_notc"
     type =  "struct<links:array<struct<rel:string,href:string>>,id:string,refName:string>"
   }
+  columns{
+    name =  "recordtype"
+    type =  "string"
+  }
+  columns{
+    name =  "deleteddate"
+    type =  "string"
+  }
+  columns{
+    name =  "op"
+    type =  "string"
+  }
  }
 
 }
@@ -2435,6 +2572,18 @@ resource "aws_glue_catalog_table" "create_table_journalentry_netsuite" {
     name =  "o:errordetails"
     type =  "array<struct<detail:string,errorCode:string>>"
   }
+  columns{
+    name =  "recordtype"
+    type =  "string"
+  }
+  columns{
+    name =  "deleteddate"
+    type =  "string"
+  }
+  columns{
+    name =  "op"
+    type =  "string"
+  }
  }
 }
 
@@ -2691,6 +2840,18 @@ resource "aws_glue_catalog_table" "create_table_vendor_netsuite" {
     name =  "o:errordetails"
     type =  "array<struct<detail:string,errorCode:string>>"
   }
+  columns{
+    name =  "recordtype"
+    type =  "string"
+  }
+  columns{
+    name =  "deleteddate"
+    type =  "string"
+  }
+  columns{
+    name =  "op"
+    type =  "string"
+  }
  }
 }
 
@@ -2923,6 +3084,18 @@ resource "aws_glue_catalog_table" "create_table_vendorbill_netsuite" {
     name =  "o:errordetails"
     type =  "array<struct<detail:string,errorCode:string>>"
   }
+  columns{
+    name =  "recordtype"
+    type =  "string"
+  }
+  columns{
+    name =  "deleteddate"
+    type =  "string"
+  }
+  columns{
+    name =  "op"
+    type =  "string"
+  }
  }
 }
 
@@ -3039,6 +3212,18 @@ resource "aws_glue_catalog_table" "create_table_vendorsubsidiaryrelationship_net
     name =  "taxitem"
     type =  "struct<links:array<string>,id:string,refName:string>"
   }
+  columns{
+    name =  "recordtype"
+    type =  "string"
+  }
+  columns{
+    name =  "deleteddate"
+    type =  "string"
+  }
+  columns{
+    name =  "op"
+    type =  "string"
+  }
  }
 }
 
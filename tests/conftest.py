@@ -0,0 +1,50 @@
+"""Loads GlueJob-netsuite-get-restApi.py as a module for the tests
+
+The job script is not importable by name, so it is loaded from its path once per session. Tests set the module
+globals that init_job would normally set (region_name, service, timezone, ...) through the job fixture.
+"""
+import importlib.util
+import os
+import sys
+from zoneinfo import ZoneInfo
+
+import pytest
+
+job_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "GlueJob-netsuite-get-restApi.py")
+
+
+@pytest.fixture(scope="session")
+def job_module():
+    spec = importlib.util.spec_from_file_location("netsuite_job", job_script)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def job(job_module, monkeypatch):
+    monkeypatch.setattr(job_module, "region_name", "eu-west-1", raising=False)
+    monkeypatch.setattr(job_module, "service", "customer", raising=False)
+    monkeypatch.setattr(job_module, "fullload", "0", raising=False)
+    monkeypatch.setattr(job_module, "netsuite_timezone", ZoneInfo("Europe/London"), raising=False)
+    return job_module
+
+
+@pytest.fixture
+def fake_netsuite(job, monkeypatch):
+    """The benchmarks' fake NetSuite without latency, with the job's client, retries and SuiteQL URL pointed at it"""
+    sys.path.insert(0, os.path.join(os.path.dirname(job_script), "benchmarks"))
+    try:
+        from fake_netsuite import FakeNetSuite, suiteql_path
+    finally:
+        sys.path.pop(0)
+    fake = FakeNetSuite(records=2500, latency="fixed:0", listing_latency="fixed:0", payload="fixed:300",
+                        retry_after=0).start()
+    client = job.NetSuiteClient(job.OAuth1Signer("1234567_SB1", "ck", "cs", "tk", "ts"))
+    monkeypatch.setattr(job, "client", client, raising=False)
+    monkeypatch.setattr(job, "suiteql_url", fake.url + suiteql_path, raising=False)
+    monkeypatch.setattr(job, "retries", job.RetrySchedule(max_attempts=3, base=0, cap=0), raising=False)
+    monkeypatch.setattr(job, "metrics", job.Metrics(exporter='off'), raising=False)
+    yield fake
+    client.close()
+    fake.stop()
@@ -0,0 +1,70 @@
+import pytest
+
+
+def record(id, name, modified="2024-01-01T00:00:00Z"):
+    return ('{"links":[{"rel":"self","href":"https://x/' + id + '"}],"id":"' + id + '","name":"' + name +
+            '","lastModifiedDate":"' + modified + '"}').encode()
+
+
+@pytest.fixture
+def index(job, tmp_path):
+    index = job.ChangeIndex(str(tmp_path), "customer")
+    index.open()
+    return index
+
+
+def test_only_records_whose_payload_changed_are_kept(index):
+    assert not index.is_unchanged("1", record("1", "Acme"))
+    assert index.is_unchanged("1", record("1", "Acme"))
+    assert not index.is_unchanged("1", record("1", "Acme Ltd"))
+    assert (index.new, index.changed, index.unchanged) == (1, 1, 1)
+
+
+def test_touch_only_modifications_count_as_unchanged(index):
+    index.is_unchanged("1", record("1", "Acme"))
+    assert index.is_unchanged("1", record("1", "Acme", modified="2024-02-01T00:00:00Z"))
+
+
+def test_key_order_does_not_change_the_fingerprint(job):
+    assert job.ChangeIndex.fingerprint(b'{"a":1,"b":{"c":2,"d":3}}') == \
+        job.ChangeIndex.fingerprint(b'{"b":{"d":3,"c":2},"a":1}')
+
+
+def test_saved_hashes_carry_over_and_discarded_ones_do_not(job, tmp_path, index):
+    index.is_unchanged("1", record("1", "Acme"))
+    index.save()
+
+    second = job.ChangeIndex(str(tmp_path), "customer")
+    second.open()
+    assert second.is_unchanged("1", record("1", "Acme"))
+    second.is_unchanged("2", record("2", "Globex"))
+    second.discard()
+
+    third = job.ChangeIndex(str(tmp_path), "customer")
+    third.open()
+    assert not third.is_unchanged("2", record("2", "Globex"))
+
+
+def test_full_load_ships_unchanged_records_but_refreshes_hashes(job, tmp_path, index, monkeypatch):
+    index.is_unchanged("1", record("1", "Acme"))
+    index.save()
+
+    monkeypatch.setattr(job, "fullload", "1")
+    reload = job.ChangeIndex(str(tmp_path), "customer")
+    reload.open()
+    assert not reload.is_unchanged("1", record("1", "Acme"))
+    assert not reload.is_unchanged("1", record("1", "Acme Ltd"))
+    reload.save()
+
+    monkeypatch.setattr(job, "fullload", "0")
+    incremental = job.ChangeIndex(str(tmp_path), "customer")
+    incremental.open()
+    assert incremental.is_unchanged("1", record("1", "Acme Ltd"))
+
+
+def test_index_built_for_a_backfill_never_suppresses(job, tmp_path):
+    backfill = job.ChangeIndex(str(tmp_path), "customer", suppress=False)
+    backfill.open()
+    backfill.is_unchanged("1", record("1", "Acme"))
+    assert not backfill.is_unchanged("1", record("1", "Acme"))
+    assert backfill.unchanged == 1
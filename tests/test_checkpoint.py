@@ -0,0 +1,47 @@
+import json
+
+
+def checkpoint(job, tmp_path):
+    point = job.Checkpoint(str(tmp_path), "customer", interval=0)
+    point.params = {"q": "lastModifiedDate ON_OR_AFTER \"01/01/2024\""}
+    return point
+
+
+def test_resume_offset_is_earliest_page_with_undelivered_ids(job, tmp_path):
+    point = checkpoint(job, tmp_path)
+    point.listed(0, ["1", "2"])
+    point.listed(1000, ["3", "4"])
+    point.listed(2000, ["5"])
+    for id in ["1", "2", "3", "5"]:
+        point.mark_delivered(id)
+    point.save()
+    state = json.loads((tmp_path / "customer.json").read_text())
+    assert state["offset"] == 1000
+    assert sorted(state["delivered"]) == ["1", "2", "3", "5"]
+
+
+def test_fully_delivered_listing_resumes_after_last_page(job, tmp_path):
+    point = checkpoint(job, tmp_path)
+    point.listed(0, ["1"])
+    point.listed(1000, ["2"])
+    point.mark_delivered("1")
+    point.mark_delivered("2")
+    point.save()
+    assert json.loads((tmp_path / "customer.json").read_text())["offset"] == 2000
+
+
+def test_load_skips_delivered_ids(job, tmp_path):
+    point = checkpoint(job, tmp_path)
+    point.listed(0, ["1", "2"])
+    point.mark_delivered("1")
+    point.save()
+
+    resumed = job.Checkpoint(str(tmp_path), "customer")
+    assert resumed.load()
+    assert resumed.offset == 0
+    assert resumed.params == point.params
+    assert resumed.listed(0, ["1", "2"]) == ["2"]
+
+
+def test_load_without_checkpoint(job, tmp_path):
+    assert not job.Checkpoint(str(tmp_path), "customer").load()
@@ -0,0 +1,24 @@
+def test_membership_across_merges(job):
+    ids = job.CompactIds(["3", "1"])
+    ids.update(str(i) for i in range(10, 10010))
+    assert "3" in ids and "10009" in ids
+    assert "2" not in ids and "10010" not in ids
+    assert len(ids) == 10002
+
+
+def test_duplicates_are_counted_once(job):
+    ids = job.CompactIds()
+    for _ in range(3):
+        ids.update(["5", "6"])
+    ids.merge()
+    ids.add("5")
+    assert len(ids) == 2
+    assert sorted(ids) == ["5", "6"]
+
+
+def test_non_numeric_and_non_canonical_ids_round_trip(job):
+    raw = ["abc-1", "007", "-4", "42"]
+    ids = job.CompactIds(raw)
+    assert all(id in ids for id in raw)
+    assert "7" not in ids and "4" not in ids
+    assert sorted(ids) == sorted(raw)
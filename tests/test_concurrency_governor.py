@@ -0,0 +1,74 @@
+import json
+import time
+
+
+class Response:
+    def __init__(self, status_code, retry_after=None, content=b''):
+        self.status_code = status_code
+        self.headers = {'Retry-After': retry_after} if retry_after is not None else {}
+        self.content = content
+
+
+def test_throttling_halves_the_limit_once_per_round(job):
+    governor = job.ConcurrencyGovernor(initial=8, maximum=10)
+    in_flight = [governor.acquire() for _ in range(4)]
+    governor.release(in_flight[0], Response(429))
+    assert governor.current_limit == 4
+    # requests sent before the limit came down were throttled by the same overload
+    governor.release(in_flight[1], Response(429))
+    assert governor.current_limit == 4
+    governor.release(governor.acquire(), Response(429))
+    assert governor.current_limit == 2
+    assert governor.throttled == 3
+
+
+def test_concurrency_limit_error_code_counts_as_throttling(job):
+    governor = job.ConcurrencyGovernor(initial=4)
+    body = b'{"o:errorDetails":[{"o:errorCode":"CONCURRENCY_LIMIT_EXCEEDED"}]}'
+    governor.release(governor.acquire(), Response(400, content=body))
+    assert governor.current_limit == 2
+
+
+def test_limit_never_drops_below_the_minimum(job):
+    governor = job.ConcurrencyGovernor(initial=1, minimum=1)
+    governor.release(governor.acquire(), Response(429))
+    assert governor.current_limit == 1
+
+
+def test_healthy_responses_grow_the_limit_by_one_per_round(job):
+    governor = job.ConcurrencyGovernor(initial=4, maximum=6)
+    for _ in range(4):
+        governor.release(governor.acquire(), Response(200))
+    assert governor.current_limit == 4
+    governor.release(governor.acquire(), Response(200))
+    assert governor.current_limit == 5
+    for _ in range(20):
+        governor.release(governor.acquire(), Response(200))
+    assert governor.current_limit == 6
+
+
+def test_server_errors_leave_the_limit_alone(job):
+    governor = job.ConcurrencyGovernor(initial=4)
+    governor.release(governor.acquire(), Response(503))
+    assert governor.limit == 4
+
+
+def test_retry_after_holds_back_new_requests(job):
+    governor = job.ConcurrencyGovernor(initial=4)
+    governor.release(governor.acquire(), Response(429, retry_after='0.3'))
+    started = time.monotonic()
+    governor.acquire()
+    assert time.monotonic() - started >= 0.25
+
+
+def test_client_reports_the_limit_per_service(job, fake_netsuite, capsys):
+    metrics = job.Metrics(exporter='emf')
+    client = job.NetSuiteClient(job.OAuth1Signer("1234567_SB1", "ck", "cs", "tk", "ts"),
+                                governor=job.ConcurrencyGovernor(initial=3), metrics=metrics)
+    client.get(fake_netsuite.url + "/services/rest/record/v1/customer/1")
+    client.close()
+    metrics.emit()
+    documents = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    document = next(d for d in documents if "ConcurrencyLimit" in d)
+    assert document["Service"] == "customer" and document["ConcurrencyLimit"] == 3
+    assert {"Name": "ConcurrencyLimit", "Unit": "Count"} in document["_aws"]["CloudWatchMetrics"][0]["Metrics"]
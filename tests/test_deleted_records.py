@@ -0,0 +1,63 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+
+class ListPacker:
+    records_failed = 0
+
+    def __init__(self):
+        self.records = []
+        self.sink = self
+
+    def put(self, data):
+        self.records.append(json.loads(data))
+
+
+@pytest.fixture
+def deletes(job, tmp_path, fake_netsuite):
+    fake_netsuite.deleted = [
+        {"recordid": 7, "deleteddate": "2024-07-01 09:15:00", "type": "Customer"},
+        {"recordid": 3, "deleteddate": "2024-07-01 10:00:00", "type": "Customer"},
+        {"recordid": 12, "deleteddate": "2024-01-15 10:00:00", "type": "Customer"},
+    ]
+    deletes = job.DeletedRecords(str(tmp_path), "customer", overlap_minutes=60)
+    deletes.load()
+    return deletes
+
+
+def test_tombstones_are_paged_and_stamped_in_utc(job, deletes, fake_netsuite):
+    assert list(deletes.tombstones(page_size=2)) == [
+        {"id": "7", "recordType": "customer", "deletedDate": "2024-07-01T08:15:00Z", "Op": "D"},
+        {"id": "3", "recordType": "customer", "deletedDate": "2024-07-01T09:00:00Z", "Op": "D"},
+        {"id": "12", "recordType": "customer", "deletedDate": "2024-01-15T10:00:00Z", "Op": "D"},
+    ]
+    assert fake_netsuite.stats()["suiteql_requests"] == 2
+
+
+def test_statement_filters_on_the_record_type_and_window(job, deletes):
+    deletes.since = datetime(2024, 7, 1, 8, 0, tzinfo=timezone.utc)
+    statement = deletes.statement()
+    assert "= 'customer'" in statement
+    assert "deleteddate >= TO_TIMESTAMP('2024-07-01 09:00:00', 'YYYY-MM-DD HH24:MI:SS')" in statement
+
+
+def test_window_starts_at_the_last_run_less_the_overlap(job, deletes, tmp_path):
+    first_since = deletes.since
+    assert first_since == datetime.combine(job.prevday, datetime.min.time(), job.netsuite_timezone)
+    deletes.save()
+    following = job.DeletedRecords(str(tmp_path), "customer", overlap_minutes=60)
+    assert following.load() == deletes.started.replace(microsecond=0) - timedelta(minutes=60)
+
+
+def test_failing_deletes_query_keeps_the_window_and_the_records(job, deletes, fake_netsuite, tmp_path):
+    fake_netsuite.forced_throttles = job.retries.max_attempts
+    packer = ListPacker()
+    extraction = job.ServiceExtraction("customer", fake_netsuite.url + "/services/rest/record/v1/customer",
+                                       packer, deletes=deletes)
+    extraction.prepared = True
+    assert extraction.ship_deletes() == 0
+    assert deletes.failed and packer.records == []
+    extraction.finish(True)
+    assert job.read_state(str(tmp_path), "customer.deletes.json") is None
@@ -0,0 +1,68 @@
+import queue
+import threading
+from collections import Counter
+
+import pytest
+
+
+def backlog(scheduler, name, count):
+    for i in range(count):
+        scheduler.put(name, i)
+
+
+def served(scheduler, count):
+    return Counter(scheduler.get(timeout=0)[0] for _ in range(count))
+
+
+def test_backlogged_services_share_by_weight(job):
+    scheduler = job.FairScheduler(queue_size=100)
+    scheduler.add("customer", weight=2)
+    scheduler.add("vendor", weight=1)
+    backlog(scheduler, "customer", 100)
+    backlog(scheduler, "vendor", 100)
+    assert served(scheduler, 30) == {"customer": 20, "vendor": 10}
+
+
+def test_slow_requests_are_charged_for_their_time(job):
+    scheduler = job.FairScheduler(queue_size=100)
+    scheduler.add("customer")
+    scheduler.add("vendor")
+    for _ in range(50):
+        scheduler.completed("vendor", 3.0)
+    backlog(scheduler, "customer", 100)
+    backlog(scheduler, "vendor", 100)
+    counts = served(scheduler, 40)
+    assert counts["customer"] == pytest.approx(3 * counts["vendor"], abs=2)
+
+
+def test_idle_service_does_not_bank_credit(job):
+    scheduler = job.FairScheduler(queue_size=100)
+    scheduler.add("customer")
+    scheduler.add("vendor")
+    backlog(scheduler, "customer", 100)
+    served(scheduler, 50)
+    backlog(scheduler, "vendor", 100)
+    # vendor joins at the current virtual time instead of taking the next 50 requests
+    assert served(scheduler, 20) == {"customer": 10, "vendor": 10}
+
+
+def test_get_times_out_when_nothing_is_queued(job):
+    scheduler = job.FairScheduler(queue_size=10)
+    scheduler.add("customer")
+    with pytest.raises(queue.Empty):
+        scheduler.get(timeout=0.05)
+
+
+def test_put_blocks_only_on_the_services_own_queue(job):
+    scheduler = job.FairScheduler(queue_size=2)
+    scheduler.add("customer")
+    scheduler.add("vendor")
+    backlog(scheduler, "customer", 2)
+    scheduler.put("vendor", 0)
+    blocked = threading.Thread(target=scheduler.put, args=("customer", 2))
+    blocked.start()
+    blocked.join(0.1)
+    assert blocked.is_alive()
+    assert scheduler.get(timeout=0) == ("customer", 0)
+    blocked.join(1)
+    assert not blocked.is_alive()
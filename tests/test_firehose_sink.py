@@ -0,0 +1,71 @@
+import pytest
+from botocore.exceptions import ClientError
+
+
+class FakeFirehose:
+    """put_record_batch stand-in failing the entries listed per call in fail_plan"""
+
+    def __init__(self, fail_plan=()):
+        self.fail_plan = list(fail_plan)
+        self.calls = []
+
+    def put_record_batch(self, DeliveryStreamName, Records):
+        self.calls.append([record['Data'] for record in Records])
+        failing = self.fail_plan.pop(0) if self.fail_plan else set()
+        if failing == 'unavailable':
+            raise ClientError({'Error': {'Code': 'ServiceUnavailableException', 'Message': 'slow down'}},
+                              'PutRecordBatch')
+        responses = [{'ErrorCode': 'ServiceUnavailableException'} if i in failing else {'RecordId': str(i)}
+                     for i in range(len(Records))]
+        return {'FailedPutCount': sum('ErrorCode' in r for r in responses), 'RequestResponses': responses}
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(job, monkeypatch):
+    monkeypatch.setattr(job.FirehoseSink, "backoff", staticmethod(lambda attempt: None))
+
+
+def test_only_failed_entries_are_redriven(job):
+    firehose = FakeFirehose(fail_plan=[{1, 3}, {0}])
+    sink = job.FirehoseSink("stream", firehose=firehose)
+    for i in range(5):
+        sink.put(b'record-%d' % i)
+    sink.flush()
+    assert firehose.calls == [
+        [b'record-0', b'record-1', b'record-2', b'record-3', b'record-4'],
+        [b'record-1', b'record-3'],
+        [b'record-1'],
+    ]
+    assert sink.records_sent == 5
+    assert sink.records_failed == 0
+
+
+def test_entries_still_failing_after_max_attempts_are_counted(job):
+    firehose = FakeFirehose(fail_plan=[{0}] * job.FirehoseSink.max_attempts)
+    sink = job.FirehoseSink("stream", firehose=firehose)
+    sink.put(b'a')
+    sink.put(b'b')
+    sink.flush()
+    assert len(firehose.calls) == job.FirehoseSink.max_attempts
+    assert sink.records_sent == 1
+    assert sink.records_failed == 1
+
+
+def test_whole_batch_is_retried_when_firehose_is_unavailable(job):
+    firehose = FakeFirehose(fail_plan=['unavailable'])
+    sink = job.FirehoseSink("stream", firehose=firehose)
+    sink.put(b'a')
+    sink.flush()
+    assert firehose.calls == [[b'a'], [b'a']]
+    assert sink.records_sent == 1
+
+
+def test_batches_respect_record_count_and_oversized_records_are_dropped(job):
+    firehose = FakeFirehose()
+    sink = job.FirehoseSink("stream", firehose=firehose)
+    sink.put(b'x' * (job.FirehoseSink.max_record_bytes + 1))
+    for i in range(job.FirehoseSink.max_batch_records + 1):
+        sink.put(b'r')
+    sink.flush()
+    assert [len(call) for call in firehose.calls] == [job.FirehoseSink.max_batch_records, 1]
+    assert sink.records_failed == 1
@@ -0,0 +1,78 @@
+import time
+
+import boto3
+import pytest
+from moto import mock_aws
+
+table_name = "netsuite-concurrency-leases"
+
+
+@pytest.fixture
+def dynamodb(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with mock_aws():
+        client = boto3.client("dynamodb", region_name="eu-west-1")
+        # same key schema as aws_dynamodb_table.create_lease_table_netsuite
+        client.create_table(
+            TableName=table_name,
+            KeySchema=[{"AttributeName": "lease_slot", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "lease_slot", "AttributeType": "N"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        yield client
+
+
+def holders(dynamodb):
+    items = dynamodb.scan(TableName=table_name)["Items"]
+    return {int(item["lease_slot"]["N"]): item["holder"]["S"] for item in items}
+
+
+def expire(dynamodb, slot):
+    dynamodb.update_item(
+        TableName=table_name,
+        Key={"lease_slot": {"N": str(slot)}},
+        UpdateExpression="SET expires_at = :past",
+        ExpressionAttributeValues={":past": {"N": str(int(time.time()) - 10)}},
+    )
+
+
+def test_acquire_claims_distinct_slots(job, dynamodb):
+    leases = job.AccountConcurrencyLeases(table_name, slots=3, ttl=120, dynamodb=dynamodb)
+    acquired = [leases.acquire() for _ in range(3)]
+    assert {slot for slot, _ in acquired} == {0, 1, 2}
+    assert len({token for _, token in acquired}) == 3
+    assert set(holders(dynamodb).values()) == {leases.holder}
+    assert leases.waits == 0
+
+
+def test_expired_slot_is_taken_back(job, dynamodb):
+    crashed = job.AccountConcurrencyLeases(table_name, slots=2, ttl=120, dynamodb=dynamodb)
+    crashed.acquire()
+    crashed.acquire()
+    expire(dynamodb, 1)
+    leases = job.AccountConcurrencyLeases(table_name, slots=2, ttl=120, dynamodb=dynamodb)
+    assert leases.acquire()[0] == 1
+    assert holders(dynamodb)[1] == leases.holder
+
+
+def test_release_only_deletes_own_lease(job, dynamodb):
+    first = job.AccountConcurrencyLeases(table_name, slots=1, ttl=120, dynamodb=dynamodb)
+    other = job.AccountConcurrencyLeases(table_name, slots=1, ttl=120, dynamodb=dynamodb)
+    lease = first.acquire()
+    other.release((lease[0], "not-the-token"))
+    assert holders(dynamodb) == {lease[0]: first.holder}
+    first.release(lease)
+    assert holders(dynamodb) == {}
+
+
+def test_expired_lease_retaken_by_the_same_run_survives_the_late_release(job, dynamodb):
+    leases = job.AccountConcurrencyLeases(table_name, slots=1, ttl=120, dynamodb=dynamodb)
+    stalled = leases.acquire()
+    expire(dynamodb, 0)
+    live = leases.acquire()
+    assert live[0] == stalled[0]
+    leases.release(stalled)
+    assert holders(dynamodb) == {0: leases.holder}
+    leases.release(live)
+    assert holders(dynamodb) == {}
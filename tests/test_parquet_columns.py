@@ -0,0 +1,52 @@
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+
+
+@pytest.fixture
+def arrow_job(job):
+    assert job.import_pyarrow()
+    return job
+
+
+def test_split_type_list_ignores_nested_commas(job):
+    assert job.split_type_list("a:int,b:struct<c:int,d:array<string>>,e:string") == \
+        ["a:int", "b:struct<c:int,d:array<string>>", "e:string"]
+
+
+def test_arrow_type_of_glue_columns(arrow_job):
+    assert arrow_job.arrow_type("bigint") == pa.int64()
+    assert arrow_job.arrow_type("varchar(255)") == pa.string()
+    assert arrow_job.arrow_type("array<string>") == pa.list_(pa.string())
+    assert arrow_job.arrow_type("struct<id:string,refName:string,lines:array<struct<amount:double>>>") == pa.struct([
+        pa.field("id", pa.string()), pa.field("refName", pa.string()),
+        pa.field("lines", pa.list_(pa.struct([pa.field("amount", pa.float64())])))])
+
+
+def test_arrow_type_rejects_unknown_types(arrow_job):
+    with pytest.raises(ValueError):
+        arrow_job.arrow_type("map<string,string>")
+
+
+def test_values_are_fitted_like_the_openx_serde(arrow_job):
+    to_row = arrow_job.column_converter(arrow_job.arrow_type(
+        "struct<id:string,isInactive:boolean,balance:double,count:int,tags:array<string>,"
+        "subsidiary:struct<id:string,refName:string>,custom:string>"))
+    assert to_row({"ID": 12, "isinactive": "true", "balance": "12.5", "count": 3.0, "tags": ["a", 1, True],
+                   "subsidiary": {"id": "1", "REFNAME": "Parent", "links": []}, "custom": {"a": [1]}}) == {
+        "id": "12", "isInactive": True, "balance": 12.5, "count": 3, "tags": ["a", "1", "true"],
+        "subsidiary": {"id": "1", "refName": "Parent"}, "custom": '{"a":[1]}'}
+
+
+def test_values_that_do_not_fit_become_null(arrow_job):
+    to_row = arrow_job.column_converter(arrow_job.arrow_type(
+        "struct<flag:boolean,small:tinyint,number:bigint,tags:array<string>,ref:struct<id:string>>"))
+    assert to_row({"flag": "yes", "small": 300, "number": "twelve", "tags": "a", "ref": "1"}) == {
+        "flag": None, "small": None, "number": None, "tags": None, "ref": None}
+    assert to_row({}) == {"flag": None, "small": None, "number": None, "tags": None, "ref": None}
+
+
+def test_booleans_are_not_numbers(arrow_job):
+    to_int = arrow_job.column_converter(pa.int32())
+    assert to_int(True) is None
+    assert to_int("7") == 7
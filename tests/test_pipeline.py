@@ -0,0 +1,78 @@
+import threading
+
+import pytest
+
+
+class ListPacker:
+    flush_on_interval = True
+
+    def flush(self):
+        pass
+
+
+class FakeExtraction:
+    """Service stand-in counting detail requests, whose ship fails from the given record on"""
+
+    def __init__(self, service, fail_from=None):
+        self.service = service
+        self.weight = 1
+        self.packer = ListPacker()
+        self.fail_from = fail_from
+        self.requests = 0
+        self.shipped = []
+        self.lock = threading.Lock()
+
+    def record_url(self, id):
+        return "https://netsuite.test/record/v1/" + self.service + "/" + id
+
+    def fetch(self, id):
+        with self.lock:
+            self.requests += 1
+        return 200, b'{"id":"' + id.encode() + b'"}', 0
+
+    def ship(self, id, data, ok):
+        if self.fail_from is not None and len(self.shipped) >= self.fail_from:
+            raise RuntimeError("sink is down")
+        self.shipped.append(id)
+
+    def save_checkpoint_if_due(self):
+        pass
+
+
+@pytest.fixture
+def pipeline_job(job, monkeypatch):
+    monkeypatch.setattr(job, "retries", job.RetrySchedule(max_attempts=3, base=0, cap=0), raising=False)
+    monkeypatch.setattr(job, "metrics", job.Metrics(exporter='off'), raising=False)
+    return job
+
+
+def ids(count):
+    return (str(i) for i in range(count))
+
+
+def test_every_record_is_fetched_and_shipped(pipeline_job):
+    extraction = FakeExtraction("customer")
+    fetched = pipeline_job.run_pipeline([(extraction, ids(500))], workers=4, queue_size=50, flush_interval=30)
+    assert fetched == 500
+    assert sorted(extraction.shipped, key=int) == [str(i) for i in range(500)]
+
+
+def test_failing_sink_stops_listing_and_fetching(pipeline_job):
+    extraction = FakeExtraction("customer", fail_from=0)
+    with pytest.raises(RuntimeError, match="sink is down"):
+        pipeline_job.run_pipeline([(extraction, ids(2000))], workers=4, queue_size=50, flush_interval=30)
+    # only what was already queued or in flight when the first ship failed gets requested
+    assert extraction.requests < 500
+
+
+def test_failing_listing_stops_the_other_services(pipeline_job):
+    def broken_listing():
+        yield "1"
+        raise SystemExit(1)
+
+    healthy = FakeExtraction("customer")
+    broken = FakeExtraction("vendor")
+    with pytest.raises(SystemExit):
+        pipeline_job.run_pipeline([(healthy, ids(5000)), (broken, broken_listing())], workers=4, queue_size=50,
+                                  flush_interval=30)
+    assert healthy.requests < 5000
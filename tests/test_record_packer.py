@@ -0,0 +1,47 @@
+import json
+
+
+class ListSink:
+    def __init__(self):
+        self.records = []
+        self.flushes = 0
+
+    def put(self, data):
+        self.records.append(data)
+
+    def flush(self):
+        self.flushes += 1
+
+
+def test_packed_records_stay_under_the_size_cap(job):
+    sink = ListSink()
+    packer = job.RecordPacker(sink, max_bytes=100)
+    for i in range(10):
+        packer.put(json.dumps({"id": str(i), "pad": "x" * 20}))
+    packer.close()
+    assert all(len(record) <= 100 for record in sink.records)
+    lines = b''.join(sink.records).splitlines()
+    assert [json.loads(line)["id"] for line in lines] == [str(i) for i in range(10)]
+    assert packer.records_in == 10 and packer.records_out == len(sink.records) > 1
+
+
+def test_cap_never_exceeds_the_firehose_record_limit(job):
+    packer = job.RecordPacker(ListSink(), max_bytes=10 * 1024 * 1024)
+    assert packer.max_bytes == job.FirehoseSink.max_record_bytes
+
+
+def test_each_record_ends_up_on_one_line(job):
+    sink = ListSink()
+    packer = job.RecordPacker(sink)
+    packer.put(b'{\n  "id": "1",\n  "memo": "two\\nlines"\n}')
+    packer.put('{"id":"2"}')
+    packer.flush()
+    assert sink.records == [b'{"id":"1","memo":"two\\nlines"}\n{"id":"2"}\n']
+    assert sink.flushes == 1
+
+
+def test_flush_without_pending_records_only_flushes_the_sink(job):
+    sink = ListSink()
+    packer = job.RecordPacker(sink)
+    packer.flush()
+    assert sink.records == [] and sink.flushes == 1
@@ -0,0 +1,110 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+
+@pytest.fixture
+def location(tmp_path):
+    return str(tmp_path)
+
+
+def open_cache(job, location, listing_url=None, window_start=None, **options):
+    cache = job.ResponseCache(location, "employee", **options)
+    cache.open(listing_url, window_start)
+    return cache
+
+
+def age(cache, id, seconds):
+    with cache.lock:
+        cache.db.execute("UPDATE response SET fetched = fetched - ? WHERE id = ?", (seconds, id))
+
+
+def test_bodies_are_served_within_their_ttl(job, location):
+    cache = open_cache(job, location, ttl_hours=1, probe=False)
+    cache.put("1", b'{"id":"1"}')
+    cache.put("2", b'{"id":"2"}')
+    age(cache, "2", 2 * 3600)
+    assert cache.get("1") == b'{"id":"1"}'
+    assert cache.get("2") is None
+    assert cache.get("3") is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_bodies_fetched_before_the_listing_window_are_refetched(job, location):
+    cache = open_cache(job, location, ttl_hours=168, probe=False)
+    cache.put("1", b'{"id":"1"}')
+    cache.put("2", b'{"id":"2"}')
+    age(cache, "1", 3 * 3600)
+    cache.save()
+
+    window_start = datetime.now(timezone.utc) - timedelta(hours=2)
+    cache = open_cache(job, location, window_start=window_start, ttl_hours=168, probe=False)
+    assert cache.get("1") is None
+    assert cache.get("2") == b'{"id":"2"}'
+
+
+def test_full_load_serves_nothing_but_refreshes(job, location, monkeypatch):
+    cache = open_cache(job, location, probe=False)
+    cache.put("1", b'{"id":"1","v":1}')
+    cache.save()
+    monkeypatch.setattr(job, "fullload", "1")
+    cache = open_cache(job, location, probe=False)
+    assert cache.get("1") is None
+    cache.put("1", b'{"id":"1","v":2}')
+    cache.save()
+    monkeypatch.setattr(job, "fullload", "0")
+    assert open_cache(job, location, probe=False).get("1") == b'{"id":"1","v":2}'
+
+
+def test_discarded_run_leaves_the_cache_as_it_was(job, location):
+    cache = open_cache(job, location, probe=False)
+    cache.put("1", b'{"id":"1"}')
+    cache.discard()
+    assert open_cache(job, location, probe=False).get("1") is None
+
+
+def test_probe_evicts_records_modified_since_the_last_run(job, location, fake_netsuite):
+    listing_url = fake_netsuite.url + "/services/rest/record/v1/employee"
+    cache = open_cache(job, location, listing_url)
+    for id in ("1", "2", "3", "4", "5"):
+        cache.put(id, b'{"id":"' + id.encode() + b'"}')
+    cache.save()
+
+    # the fake lists ids 1..3 as modified since the saved probe time
+    fake_netsuite.records = 3
+    cache = open_cache(job, location, listing_url)
+    assert [cache.get(id) is not None for id in ("1", "2", "3", "4", "5")] == [False, False, False, True, True]
+    cache.save()
+
+    # evicted for good: a later run that no longer sees the change cannot serve the old body
+    fake_netsuite.records = 0
+    cache = open_cache(job, location, listing_url)
+    assert cache.get("1") is None and cache.get("4") is not None
+
+
+def test_failed_probe_serves_nothing_and_keeps_the_probe_time(job, location, fake_netsuite):
+    listing_url = fake_netsuite.url + "/services/rest/record/v1/employee"
+    cache = open_cache(job, location, listing_url)
+    cache.put("1", b'{"id":"1"}')
+    cache.save()
+    probed = time.time()
+
+    # more changes than one probe page can list
+    fake_netsuite.records = 2500
+    cache = open_cache(job, location, listing_url)
+    assert cache.get("1") is None and cache.probe_failed
+    cache.save()
+    cache = job.ResponseCache(location, "employee")
+    cache.connect()
+    assert cache.db.execute("SELECT max(probed) FROM probe").fetchone()[0] < probed
+
+
+def test_listing_window_start(job, monkeypatch):
+    london = job.netsuite_timezone
+    assert job.listing_window_start({}) is None
+    assert job.listing_window_start({'q': 'lastModifiedDate ON_OR_AFTER "01/07/2024 01:30 PM"'}) == \
+        datetime(2024, 7, 1, 13, 30, tzinfo=london)
+    monkeypatch.setattr(job, "yesterday", "30/06/2024")
+    monkeypatch.setattr(job, "today", "01/07/2024")
+    assert job.listing_window_start(job.listing_params()) == datetime(2024, 6, 30, tzinfo=london)
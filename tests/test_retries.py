@@ -0,0 +1,39 @@
+import time
+
+import pytest
+
+
+@pytest.mark.parametrize("status, body, expected", [
+    (None, b"", True),
+    (429, b"", True),
+    (500, b"", True),
+    (503, b"", True),
+    (400, b'{"o:errorDetails":[{"o:errorCode":"CONCURRENCY_LIMIT_EXCEEDED"}]}', True),
+    (400, b'{"o:errorDetails":[{"o:errorCode":"INVALID_PARAMETER"}]}', False),
+    (404, b'{"o:errorDetails":[{"o:errorCode":"NONEXISTENT_ID"}]}', False),
+])
+def test_is_retryable(job, status, body, expected):
+    assert job.is_retryable(status, body) is expected
+
+
+def test_retry_delay_respects_retry_after_and_cap(job):
+    assert job.retry_delay(1, retry_after=30, base=1, cap=60) >= 30
+    assert all(0 <= job.retry_delay(10, base=1, cap=5) <= 5 for _ in range(100))
+
+
+def test_schedule_spends_attempt_budget(job):
+    retries = job.RetrySchedule(max_attempts=3, base=0, cap=0)
+    assert retries.schedule("task", 1)
+    assert retries.schedule("task", 2)
+    assert not retries.schedule("task", 3)
+    assert retries.retried == 2
+
+
+def test_pop_due_waits_out_the_delay(job):
+    retries = job.RetrySchedule(max_attempts=6, base=0, cap=0)
+    retries.schedule("later", 1, retry_after=60)
+    retries.schedule("now", 1)
+    assert retries.pop_due() == ("now", 1)
+    assert retries.pop_due() is None
+    retries.heap[0] = (time.monotonic() - 1,) + retries.heap[0][1:]
+    assert retries.pop_due() == ("later", 1)
@@ -0,0 +1,82 @@
+import json
+
+import pytest
+
+
+@pytest.fixture
+def run(job, tmp_path, monkeypatch):
+    """A two-shard run of customer whose summaries and watermark live in tmp_path"""
+    monkeypatch.setattr(job, "run_id", "20240701T000000Z-abcdef12", raising=False)
+    monkeypatch.setattr(job, "run_summary_location", str(tmp_path / "runs"), raising=False)
+    extraction = job.ServiceExtraction(
+        "customer", "https://netsuite.test/record/v1/customer", packer=None,
+        watermark=job.Watermark(str(tmp_path / "watermarks"), "customer"), shard=(0, 2))
+    monkeypatch.setattr(job, "extractions", [extraction], raising=False)
+    return extraction
+
+
+def write_summary(job, index, completed=True, records=10, failed_ids=(), max_last_modified=None,
+                  listing_failed=(), firehose_failed=0):
+    job.write_state(job.run_summary_location, job.shard_summary_name(index, 2), json.dumps({
+        "service": "customer", "run_id": job.run_id, "shard": index, "shards": 2, "completed": completed,
+        "seconds": 10.0 + index, "retries": 1, "throttled": 2, "firehose_failed": firehose_failed,
+        "listing_failed": list(listing_failed),
+        "services": {"customer": {"records": records, "failed_ids": list(failed_ids),
+                                  "max_last_modified": max_last_modified}}
+    }))
+
+
+def test_waits_for_every_shard(job, run):
+    write_summary(job, 0)
+    assert job.combine_shard_summaries(2) is None
+
+
+def test_combines_shards_and_advances_the_watermark(job, run):
+    write_summary(job, 0, records=10, max_last_modified="2024-06-30T10:00:00Z")
+    write_summary(job, 1, records=15, max_last_modified="2024-06-30T12:00:00Z")
+    combined = job.combine_shard_summaries(2)
+    assert combined["completed"] and combined["records"] == 25
+    assert combined["retries"] == 2 and combined["throttled"] == 4 and combined["seconds"] == 11.0
+    assert combined["failed_urls"] == []
+    assert run.watermark.load() == "2024-06-30T12:00:00Z"
+    stored = json.loads(job.read_state(job.run_summary_location, "customer/" + job.run_id + "/summary.json"))
+    assert stored == combined
+    # the merged shard summaries are gone, so a later run can never combine them again
+    assert job.read_state(job.run_summary_location, job.shard_summary_name(0, 2)) is None
+    assert job.shards_exit_code([0, 0], combined) == 0
+
+
+def test_only_one_finishing_shard_combines(job, run):
+    write_summary(job, 0)
+    write_summary(job, 1)
+    assert job.create_state(job.run_summary_location, "customer/" + job.run_id + "/combined.lock", job.run_id)
+    assert job.combine_shard_summaries(2) is None
+
+
+def test_incomplete_shard_keeps_the_watermark_and_fails_the_run(job, run):
+    write_summary(job, 0, max_last_modified="2024-06-30T10:00:00Z")
+    write_summary(job, 1, completed=False, max_last_modified="2024-06-30T12:00:00Z")
+    combined = job.combine_shard_summaries(2)
+    assert not combined["completed"] and combined["incomplete_shards"] == [1]
+    assert run.watermark.load() is None
+    assert job.shards_exit_code([0, 0], combined) == 1
+
+
+@pytest.mark.parametrize("missed", [
+    {"failed_ids": ["42"]},
+    {"firehose_failed": 3},
+    {"listing_failed": ["https://netsuite.test/record/v1/customer"]},
+])
+def test_missed_records_keep_the_watermark(job, run, missed):
+    write_summary(job, 0, max_last_modified="2024-06-30T10:00:00Z", **missed)
+    write_summary(job, 1, max_last_modified="2024-06-30T12:00:00Z")
+    combined = job.combine_shard_summaries(2)
+    assert combined["completed"]
+    assert run.watermark.load() is None
+    if "failed_ids" in missed:
+        assert combined["failed_urls"] == ["https://netsuite.test/record/v1/customer/42"]
+
+
+def test_failed_shard_process_or_missing_summary_fails_the_run(job):
+    assert job.shards_exit_code([0, 1], {"completed": True}) == 1
+    assert job.shards_exit_code([0, 0], None) == 1
@@ -0,0 +1,57 @@
+import pytest
+
+
+def test_statement_pages_by_id_and_names_references(job, monkeypatch):
+    monkeypatch.setattr(job, "fullload", "1")
+    statement = job.suiteql_statement(job.suiteql_queries['subsidiary'], 2000)
+    assert statement == (
+        "SELECT id, name, legalname, email, url, lastmodifieddate, iselimination, isinactive, "
+        "country, BUILTIN.DF(country) AS country_refname, currency, BUILTIN.DF(currency) AS currency_refname, "
+        "parent, BUILTIN.DF(parent) AS parent_refname FROM subsidiary WHERE id > 2000 ORDER BY id")
+
+
+def test_incremental_transaction_statement(job, monkeypatch):
+    monkeypatch.setattr(job, "yesterday", "01/07/2024")
+    monkeypatch.setattr(job, "today", "02/07/2024")
+    statement = job.suiteql_statement(job.suiteql_queries['invoice'], 0)
+    assert statement.endswith(
+        " FROM transaction WHERE id > 0 AND type = 'CustInvc'"
+        " AND lastmodifieddate >= TO_DATE('01/07/2024', 'DD/MM/YYYY')"
+        " AND lastmodifieddate < TO_DATE('02/07/2024', 'DD/MM/YYYY') ORDER BY id")
+
+
+def test_row_to_record_matches_the_rest_record_shape(job):
+    config = job.suiteql_queries['customer']
+    row = {"links": [], "id": "7", "companyname": "Acme", "isinactive": "F", "isperson": "T",
+           "currency": 1, "currency_refname": "GBP", "subsidiary": "3"}
+    assert job.suiteql_row_to_record(row, config) == {
+        "id": "7", "companyname": "Acme", "isinactive": False, "isperson": True,
+        "currency": {"id": "1", "refName": "GBP"}, "subsidiary": {"id": "3", "refName": None}}
+
+
+def test_records_are_paged_through_the_fake_endpoint(job, fake_netsuite, monkeypatch):
+    monkeypatch.setattr(job, "service", "customer")
+    monkeypatch.setattr(job, "fullload", "1")
+    records = list(job.iter_suiteql_records())
+    assert [record["id"] for record in records] == [str(i) for i in range(1, 2501)]
+    assert records[0]["isinactive"] is True and records[1]["isinactive"] is False
+    assert records[0]["currency"] == {"id": "2", "refName": "Name 2"}
+    assert "links" not in records[0]
+    assert fake_netsuite.stats()["suiteql_requests"] == 3
+
+
+def test_throttled_pages_are_retried(job, fake_netsuite, monkeypatch):
+    monkeypatch.setattr(job, "service", "customer")
+    monkeypatch.setattr(job, "fullload", "1")
+    fake_netsuite.forced_throttles = 2
+    assert len(list(job.iter_suiteql_records())) == 2500
+    assert fake_netsuite.stats()["throttled"] == 2
+
+
+def test_page_failing_every_attempt_fails_the_job(job, fake_netsuite, monkeypatch):
+    monkeypatch.setattr(job, "service", "customer")
+    monkeypatch.setattr(job, "fullload", "1")
+    fake_netsuite.forced_throttles = job.retries.max_attempts
+    with pytest.raises(SystemExit):
+        list(job.iter_suiteql_records())
+    assert fake_netsuite.stats()["suiteql_requests"] == 0
@@ -0,0 +1,33 @@
+import json
+from datetime import datetime
+
+
+def test_since_is_none_before_first_watermark(job, tmp_path):
+    watermark = job.Watermark(str(tmp_path), "customer")
+    assert watermark.load() is None
+    assert watermark.since() is None
+
+
+def test_since_subtracts_overlap_in_account_time_zone(job, tmp_path):
+    (tmp_path / "customer.json").write_text(json.dumps({"lastModifiedDate": "2024-07-01T12:30:00Z"}))
+    watermark = job.Watermark(str(tmp_path), "customer", overlap_minutes=60)
+    watermark.load()
+    since = watermark.since()
+    # 12:30 UTC less an hour is 12:30 British Summer Time
+    assert since.strftime(job.netsuite_datetime_format) == "01/07/2024 12:30 PM"
+    assert since.utcoffset().total_seconds() == 3600
+
+
+def test_save_only_moves_forward(job, tmp_path):
+    watermark = job.Watermark(str(tmp_path), "customer")
+    watermark.observe(b'{"id":"1","lastModifiedDate":"2024-01-02T00:00:00Z"}')
+    watermark.observe(b'{"id":"2","lastModifiedDate":"2024-01-01T00:00:00Z"}')
+    watermark.save()
+    assert watermark.load() == "2024-01-02T00:00:00Z"
+
+    older = job.Watermark(str(tmp_path), "customer")
+    older.load()
+    older.observe(b'{"lastModifiedDate":"2023-12-31T00:00:00Z"}')
+    older.save()
+    assert older.load() == "2024-01-02T00:00:00Z"
+    assert isinstance(older.since(), datetime)